@@ -1,12 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from passlib.context import CryptContext
-from jose import jwt
-from datetime import datetime, timedelta
+import asyncio
+from fastapi import APIRouter, HTTPException
 from psycopg2.extras import RealDictCursor
-from cement_operations_optimization.db import get_db_connection
+from cement_operations_optimization.db import PoolTimeoutError, db_connection
 import os as process
 from dotenv import load_dotenv
 from cement_operations_optimization.utils.auth import create_access_token
+from cement_operations_optimization.utils.password_hasher import HasherOverloadedError, password_hasher
 
 from cement_operations_optimization.models.users import Token, UserCreate, UserOut
 
@@ -18,49 +17,78 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 router = APIRouter()
 
-def hash_password(password: str):
-    return pwd_context.hash(password)
+# references to running rehash tasks, so they are not garbage collected early
+_background_tasks = set()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def _overloaded(e: Exception) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+def _find_user(email: str):
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
+        return cur.fetchone()
+
+def _create_user(email: str, hashed_pw: str):
+    """Inserts the user and returns (id, email), or None if the email is taken."""
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
+        if cur.fetchone():
+            return None
+        cur.execute(
+            "INSERT INTO users ( email, hashed_password) VALUES (%s, %s) RETURNING id, email",
+            ( email, hashed_pw),
+        )
+        new_user = cur.fetchone()
+        conn.commit()
+        return new_user
+
+def _replace_hash(email: str, old_hash: str, new_hash: str):
+    with db_connection() as conn, conn.cursor() as cur:
+        # only if the password was not changed in the meantime
+        cur.execute(
+            "UPDATE users SET hashed_password = %s WHERE email = %s AND hashed_password = %s",
+            (new_hash, email, old_hash),
+        )
+        conn.commit()
+
+async def _rehash(email: str, password: str, old_hash: str):
+    """Upgrade a hash made with an older bcrypt cost; best effort, after the login response."""
+    try:
+        new_hash = await password_hasher.hash(password)
+        await asyncio.to_thread(_replace_hash, email, old_hash, new_hash)
+    except Exception as e:
+        print(f"Password rehash for {email} skipped: {e}")
 
 
 @router.post("/signup", response_model=UserOut)
-def signup(user: UserCreate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = %s", (user.email,))
-    existing_user = cur.fetchone()
-    if existing_user:
-        cur.close()
-        conn.close()
+async def signup(user: UserCreate):
+    try:
+        # hash before borrowing, so a pooled connection is not held through bcrypt
+        hashed_pw = await password_hasher.hash(user.password)
+        new_user = await asyncio.to_thread(_create_user, user.email, hashed_pw)
+    except (HasherOverloadedError, PoolTimeoutError) as e:
+        raise _overloaded(e)
+    if new_user is None:
         raise HTTPException(status_code=400, detail="Email already registered")
-
-    hashed_pw = hash_password(user.password)
-    cur.execute(
-        "INSERT INTO users ( email, hashed_password) VALUES (%s, %s) RETURNING id, email",
-        ( user.email, hashed_pw),
-    )
-    new_user = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
     return new_user
 
 @router.post("/login", response_model=Token)
-def login(user: UserCreate):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM users WHERE email = %s", (user.email,))
-    db_user = cur.fetchone()
-    cur.close()
-    conn.close()
-
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+async def login(user: UserCreate):
+    try:
+        db_user = await asyncio.to_thread(_find_user, user.email)
+        valid = bool(db_user) and await password_hasher.verify(user.password, db_user["hashed_password"])
+    except (HasherOverloadedError, PoolTimeoutError) as e:
+        raise _overloaded(e)
+
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    if password_hasher.needs_update(db_user["hashed_password"]):
+        task = asyncio.create_task(_rehash(db_user["email"], user.password, db_user["hashed_password"]))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
     token = create_access_token({"sub": db_user["email"]})
     return {"access_token": token, "token_type": "bearer"}
@@ -0,0 +1,150 @@
+"""
+Long-running batch consumer for the ingestion and inference pipeline.
+
+    python -m cement_operations_optimization.data_generator.batch_worker --mode raw
+    python -m cement_operations_optimization.data_generator.batch_worker --mode predict
+    python -m cement_operations_optimization.data_generator.batch_worker --mode live
+
+"live" consumes cement-raw and computes the model features in-process with
+the streaming feature engine instead of waiting for cement_features_enriched.
+
+Set PUBSUB_EMULATOR_HOST to run against the Pub/Sub emulator, or use
+--source queue to drive the pipeline from an in-process queue filled with
+synthetic records.
+"""
+import os
+import json
+import atexit
+import signal
+import argparse
+import asyncio
+import threading
+import time
+from typing import List
+
+from cement_operations_optimization.utils.batch_consumer import BatchConsumer, PubSubSource, QueueSource
+
+PROJECT_ID = os.getenv("GCP_PROJECT_ID", os.getenv("GCP_PROJECT", "cement-operations-optimization"))
+RAW_SUBSCRIPTION = os.getenv("RAW_SUBSCRIPTION", "cement-raw-sub")
+ENRICHED_SUBSCRIPTION = os.getenv("ENRICHED_SUBSCRIPTION", "cement-features-enriched-sub")
+BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "500"))
+MAX_WAIT_SECONDS = float(os.getenv("WORKER_MAX_WAIT_SECONDS", "0.5"))
+
+
+def raw_stages() -> list:
+    from cement_operations_optimization.data_generator import main as ingest
+    from cement_operations_optimization.data_generator.hourly_aggregator import CHECKPOINT_PATH, HourlyAggregator
+    from cement_operations_optimization.utils.bq_writer import InsertError
+
+    # the only hourly aggregator: it needs every reading of an hour, which a
+    # per-event function instance never sees
+    aggregator = HourlyAggregator.restore(CHECKPOINT_PATH)
+    # emitted buckets BigQuery did not take; the aggregator no longer has
+    # them, so they are retried with the next batch
+    unwritten: List[dict] = []
+
+    def write_buckets(finished: List[dict]) -> bool:
+        """Write (and flush) pending and newly finished buckets; False if any failed."""
+        buckets = unwritten + finished
+        unwritten.clear()
+        if not buckets:
+            return True
+        try:
+            ingest.writer.write_through(ingest.hourly_table_ref, buckets)
+        except InsertError as e:
+            print(f"Keeping {len(e.failed)} hourly bucket(s) for retry:", e)
+            unwritten.extend(row for row, _ in e.failed)
+            return False
+        return True
+
+    def close_hourly():
+        # buckets go to BigQuery before the checkpoint that forgets them
+        if write_buckets([]) and CHECKPOINT_PATH:
+            aggregator.maybe_checkpoint(CHECKPOINT_PATH, interval_seconds=0)
+
+    atexit.register(close_hourly)
+
+    def to_rows(records: List[dict]) -> List[dict]:
+        rows = []
+        for r in records:
+            try:
+                rows.append(ingest.raw_record_to_row(r))
+            except (KeyError, TypeError) as e:
+                print("Dropping malformed raw record:", e)
+        return rows
+
+    def sink(rows: List[dict]) -> List[dict]:
+        # rows must be in BigQuery before the batch is acked; raising nacks it
+        ingest.writer.write_through(ingest.table_ref, rows)
+        return rows
+
+    def hourly(rows: List[dict]) -> List[dict]:
+        """Feed raw rows to the hourly aggregator and write out finished buckets."""
+        finished = []
+        for r in rows:
+            finished.extend(aggregator.add(r))
+        # emitted buckets must be written before the checkpoint forgets them
+        if write_buckets(finished) and CHECKPOINT_PATH:
+            aggregator.maybe_checkpoint(CHECKPOINT_PATH)
+        return rows
+
+    return [to_rows, sink, hourly]
+
+
+def predict_stages(live: bool = False) -> list:
+    """One batch stage that drives the shared asyncio inference pipeline."""
+    from cement_operations_optimization.ml_train_deploy.engine import InferencePipeline, default_stages
+
+    pipeline = InferencePipeline(default_stages(live=live))
+    # the pipeline's worker tasks live on this loop between batches
+    loop = asyncio.new_event_loop()
+
+    def run_pipeline(records: List[dict]) -> List[dict]:
+        return loop.run_until_complete(pipeline.process(records))
+
+    return [run_pipeline]
+
+
+def _feed_synthetic(source: QueueSource, rate: float, stop: threading.Event):
+    from cement_operations_optimization.data_generator.cement_data_service import generate_record
+
+    interval = 1.0 / rate if rate > 0 else 0
+    while not stop.is_set():
+        source.publish(json.dumps(generate_record()).encode("utf-8"))
+        if interval:
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["raw", "predict", "live"], default="raw")
+    parser.add_argument("--source", choices=["pubsub", "queue"], default="pubsub")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT_SECONDS)
+    parser.add_argument("--rate", type=float, default=0, help="Synthetic records/sec for --source queue (0 = unthrottled)")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    if args.source == "queue":
+        if args.mode == "predict":
+            raise SystemExit("--source queue only generates raw records; use --mode raw or live")
+        source = QueueSource(maxsize=args.batch_size * 4)
+        threading.Thread(target=_feed_synthetic, args=(source, args.rate, stop), daemon=True).start()
+    else:
+        subscription = ENRICHED_SUBSCRIPTION if args.mode == "predict" else RAW_SUBSCRIPTION
+        source = PubSubSource(f"projects/{PROJECT_ID}/subscriptions/{subscription}", max_outstanding=args.batch_size * 4)
+
+    stages = raw_stages() if args.mode == "raw" else predict_stages(live=args.mode == "live")
+    # stop between batches, so atexit checkpoints the aggregator and flushes the writer
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    consumer = BatchConsumer(source, stages, batch_size=args.batch_size, max_wait_seconds=args.max_wait)
+    print(f"Batch worker started: mode={args.mode} source={args.source} batch_size={args.batch_size}")
+    try:
+        consumer.run(stop)
+    except KeyboardInterrupt:
+        stop.set()
+    print(f"Batch worker stopped after {consumer.processed} messages")
+
+
+if __name__ == "__main__":
+    main()
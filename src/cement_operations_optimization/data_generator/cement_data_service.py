@@ -3,12 +3,12 @@ import json
 import random
 import asyncio
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, WebSocket, Query
-from starlette.websockets import WebSocketDisconnect
-from cement_operations_optimization.data_generator.pubsub_push import connected_websockets
+from fastapi import APIRouter, Depends, WebSocket, Query
+from cement_operations_optimization.data_generator.pubsub_push import data_broadcaster
+from cement_operations_optimization.utils.auth import authenticate
 from google.cloud import pubsub_v1
 
 # ----------------------------
@@ -22,14 +22,41 @@ router = APIRouter(tags=["Cement Data"])
 load_dotenv()
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "cement-operations-optimization")
 TOPIC_ID = os.getenv("PUBSUB_TOPIC_ID", "cement-raw")
-publisher = pubsub_v1.PublisherClient()
+PUBLISH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "500"))
+PUBLISH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+PUBLISH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY_SECONDS", "0.05"))
+
+# The client groups publishes into batched requests in its own threads
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=pubsub_v1.types.BatchSettings(
+        max_messages=PUBLISH_MAX_MESSAGES,
+        max_bytes=PUBLISH_MAX_BYTES,
+        max_latency=PUBLISH_MAX_LATENCY,
+    )
+)
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
 
-def publish_to_pubsub(record: Dict):
-    """Publish record to Pub/Sub."""
-    data = json.dumps(record).encode("utf-8")
-    future = publisher.publish(topic_path, data)
-    return future.result()
+async def publish_batch(records: List[Dict]) -> List[Dict]:
+    """
+    Publish records to Pub/Sub without blocking the event loop.
+    Returns {"message_id": ...} or {"error": ...} per record, in order.
+    """
+    futures = [
+        asyncio.wrap_future(publisher.publish(topic_path, json.dumps(r).encode("utf-8")))
+        for r in records
+    ]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    out = []
+    for res in results:
+        if isinstance(res, BaseException):
+            out.append({"error": str(res)})
+        else:
+            out.append({"message_id": res})
+    return out
+
+async def publish_to_pubsub(record: Dict) -> Dict:
+    """Publish one record to Pub/Sub."""
+    return (await publish_batch([record]))[0]
 
 # ----------------------------
 # Synthetic data generator
@@ -101,29 +128,32 @@ async def health_check():
 @router.get("/latest")
 async def get_latest():
     record = generate_record()
-    publish_to_pubsub(record)
+    result = await publish_to_pubsub(record)
+    if "error" in result:
+        print("Pub/Sub publish failed:", result["error"])
     return record
 
 @router.get("/batch")
 async def get_batch(size: int = Query(10, gt=0, le=1000)):
     records = [generate_record() for _ in range(size)]
-    for r in records:
-        publish_to_pubsub(r)
+    results = await publish_batch(records)
+    failed = [r["error"] for r in results if "error" in r]
+    if failed:
+        print(f"Pub/Sub publish failed for {len(failed)}/{len(records)} records: {failed[0]}")
     return records
 
+@router.on_event("shutdown")
+async def close_data_websockets():
+    await data_broadcaster.close()
+
 @router.websocket("/ws/data")
-async def websocket_data(ws: WebSocket):
+async def websocket_data(ws: WebSocket, user: Optional[str] = Depends(authenticate)):
     await ws.accept()
-    connected_websockets.add(ws)
-    try:
+
+    async def send_records(ws: WebSocket):
         while True:
-            record = generate_record()
-            await ws.send_json(record)
+            # queued like broadcasts, so the socket only ever has one writer
+            data_broadcaster.send(ws, generate_record())
             await asyncio.sleep(2)  # send every 2 seconds
-    except Exception:
-        pass
-    finally:
-        try:
-            connected_websockets.remove(ws)
-        except Exception:
-            pass
+
+    await data_broadcaster.serve(ws, producer=send_records)
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from cement_operations_optimization.ml_train_deploy.streaming_features import RAW_METRICS, parse_timestamp
+
+ALLOWED_LATENESS_SECONDS = float(os.getenv("HOURLY_ALLOWED_LATENESS_SECONDS", "300"))
+CHECKPOINT_PATH = os.getenv("HOURLY_CHECKPOINT_PATH")  # local path or gs://bucket/object
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("HOURLY_CHECKPOINT_INTERVAL_SECONDS", "60"))
+
+BucketKey = Tuple[str, int]  # (equipment, hours since epoch)
+
+
+def _read_checkpoint(path: str) -> Optional[str]:
+    if path.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket, _, name = path[len("gs://"):].partition("/")
+        blob = storage.Client().bucket(bucket).blob(name)
+        return blob.download_as_text() if blob.exists() else None
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _write_checkpoint(path: str, data: str):
+    if path.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket, _, name = path[len("gs://"):].partition("/")
+        storage.Client().bucket(bucket).blob(name).upload_from_string(data, content_type="application/json")
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class HourlyAggregator:
+    """
+    Incrementally builds the hourly avg_* aggregates from raw readings.
+
+    Keeps running sums/counts per (equipment, hour). The watermark is the
+    newest event time seen minus allowed_lateness; a bucket is emitted once
+    the watermark passes the end of its hour. Readings for buckets that were
+    already emitted are counted in late_dropped and ignored.
+    """
+
+    def __init__(self, allowed_lateness_seconds: float = ALLOWED_LATENESS_SECONDS):
+        self.allowed_lateness_seconds = allowed_lateness_seconds
+        self.late_dropped = 0
+        self._sums: Dict[BucketKey, List[float]] = {}
+        self._counts: Dict[BucketKey, int] = {}
+        self._max_event_ts = 0.0
+        self._closed_before = 0  # every hour < this has been emitted
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+
+    @property
+    def watermark(self) -> float:
+        return self._max_event_ts - self.allowed_lateness_seconds
+
+    def add(self, row: dict) -> List[dict]:
+        """
+        Add one reading (cement_raw row or generator record) and return the
+        buckets that closed because of it.
+        """
+        ts = parse_timestamp(row["timestamp"]).timestamp()
+        hour = int(ts // 3600)
+        metrics = row.get("metrics", row)
+        with self._lock:
+            if hour < self._closed_before:
+                self.late_dropped += 1
+                return []
+            key = (row["equipment"], hour)
+            sums = self._sums.get(key)
+            if sums is None:
+                sums = self._sums[key] = [0.0] * len(RAW_METRICS)
+                self._counts[key] = 0
+            for i, name in enumerate(RAW_METRICS):
+                v = metrics.get(name)
+                if v is not None:
+                    sums[i] += float(v)
+            self._counts[key] += 1
+            if ts > self._max_event_ts:
+                self._max_event_ts = ts
+            return self._collect(int(self.watermark // 3600))
+
+    def flush_all(self) -> List[dict]:
+        """Emit every open bucket regardless of the watermark (shutdown)."""
+        with self._lock:
+            return self._collect(max(hour for _, hour in self._sums) + 1 if self._sums else self._closed_before)
+
+    def _collect(self, close_before: int) -> List[dict]:
+        if close_before <= self._closed_before:
+            return []
+        self._closed_before = close_before
+        done = sorted((k for k in self._sums if k[1] < close_before), key=lambda k: (k[1], k[0]))
+        out = []
+        for key in done:
+            sums, count = self._sums.pop(key), self._counts.pop(key)
+            equipment, hour = key
+            row = {
+                "equipment": equipment,
+                "hour_bucket": datetime.fromtimestamp(hour * 3600, tz=timezone.utc).isoformat(),
+                "reading_count": count,
+            }
+            for i, name in enumerate(RAW_METRICS):
+                row[f"avg_{name}"] = sums[i] / count
+            out.append(row)
+        return out
+
+    # ---------------------------
+    # Checkpointing
+    # ---------------------------
+    def to_state(self) -> dict:
+        with self._lock:
+            return {
+                "max_event_ts": self._max_event_ts,
+                "closed_before": self._closed_before,
+                "late_dropped": self.late_dropped,
+                "buckets": [
+                    [eq, hour, self._counts[(eq, hour)], sums]
+                    for (eq, hour), sums in self._sums.items()
+                ],
+            }
+
+    def load_state(self, state: dict):
+        with self._lock:
+            self._max_event_ts = float(state.get("max_event_ts", 0.0))
+            self._closed_before = int(state.get("closed_before", 0))
+            self.late_dropped = int(state.get("late_dropped", 0))
+            self._sums = {}
+            self._counts = {}
+            for eq, hour, count, sums in state.get("buckets", []):
+                self._sums[(eq, int(hour))] = [float(s) for s in sums]
+                self._counts[(eq, int(hour))] = int(count)
+
+    def checkpoint(self, path: str):
+        _write_checkpoint(path, json.dumps(self.to_state()))
+        self._last_checkpoint = time.monotonic()
+
+    def checkpoint_due(self, interval_seconds: float = CHECKPOINT_INTERVAL_SECONDS) -> bool:
+        return time.monotonic() - self._last_checkpoint >= interval_seconds
+
+    def maybe_checkpoint(self, path: Optional[str], interval_seconds: float = CHECKPOINT_INTERVAL_SECONDS):
+        if path and self.checkpoint_due(interval_seconds):
+            try:
+                self.checkpoint(path)
+            except Exception as e:
+                print("Hourly aggregator checkpoint failed:", e)
+
+    @classmethod
+    def restore(cls, path: Optional[str], **kwargs) -> "HourlyAggregator":
+        """Build an aggregator from a checkpoint if one exists, else start empty."""
+        agg = cls(**kwargs)
+        if not path:
+            return agg
+        try:
+            data = _read_checkpoint(path)
+            if data:
+                agg.load_state(json.loads(data))
+                print(f"Restored hourly aggregator from {path}")
+        except Exception as e:
+            print(f"Could not restore hourly aggregator from {path}: {e}")
+        return agg
@@ -2,22 +2,39 @@ import base64
 import json
 import os
 from google.cloud import bigquery
-from fastapi import APIRouter
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from cement_operations_optimization.utils.bq_writer import BatchingRowWriter
+from cement_operations_optimization.ml_train_deploy.streaming_features import FEATURE_COLS
+from cement_operations_optimization.trends.hot_store import hot_store
+from cement_operations_optimization.utils.bq_executor import QueryTimeoutError, bq_executor
+from cement_operations_optimization.utils.cursor import BEFORE_CURSOR_SQL, decode_cursor, row_cursor
+from cement_operations_optimization.utils.streaming import (
+    JSON, batches_from_rows, negotiate_format, prefetch, streaming_response,
+)
 
 BQ_PROJECT = "cement-operations-optimization"
 BQ_DATASET = os.getenv("BQ_DATASET", "plant")
 BQ_TABLE = os.getenv("BQ_TABLE", "cement_raw")
+BQ_HOURLY_TABLE = os.getenv("BQ_HOURLY_TABLE", "cement_hourly")
+PREDICTIONS_TABLE = os.getenv("PREDICTIONS_TABLE", "cement_predictions")
+PREDICTIONS_MAX_PAGE_SIZE = int(os.getenv("PREDICTIONS_MAX_PAGE_SIZE", "1000"))
+
+# only returned when asked for by name: prediction_raw is large, and the others
+# are only set by the per-reading path in pubsub_infer
+PREDICTION_COLUMNS = ["seq_id", "equipment", "prediction_time", *FEATURE_COLS, "is_anomaly", "anomaly_prob"]
+PREDICTION_OPTIONAL_COLUMNS = ["prediction_raw", "timestamp", "ingest_time"]
 
 client = bigquery.Client(project=BQ_PROJECT)
 table_ref = client.dataset(BQ_DATASET).table(BQ_TABLE)
+hourly_table_ref = client.dataset(BQ_DATASET).table(BQ_HOURLY_TABLE)
+writer = BatchingRowWriter(client)
 router = APIRouter()
 
-def pubsub_to_bq(event, context):
-    """Triggered by Pub/Sub message → Insert into BigQuery."""
-    payload = base64.b64decode(event["data"]).decode("utf-8")
-    row = json.loads(payload)
-
-    row_to_insert = {
+def raw_record_to_row(row: dict) -> dict:
+    """Flatten a generator record into a cement_raw row."""
+    return {
         "timestamp": row["timestamp"],
         "equipment": row["equipment"],
         "temperature": row["metrics"]["temperature"],
@@ -31,20 +48,104 @@ def pubsub_to_bq(event, context):
         "anomaly_type": row.get("anomaly_type", None),
     }
 
-    errors = client.insert_rows_json(table_ref, [row_to_insert])
-    if errors:
-        print("BigQuery insert errors:", errors)
+
+def select_prediction_columns(fields: Optional[str]) -> List[str]:
+    """Validated projection for /predictions; the keyset columns are always included."""
+    if not fields:
+        return list(PREDICTION_COLUMNS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PREDICTION_COLUMNS + PREDICTION_OPTIONAL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    columns = ["seq_id", "prediction_time"]
+    columns += [f for f in requested if f not in columns]
+    return columns
+
+
+def pubsub_to_bq(event, context):
+    """
+    Triggered by Pub/Sub message → Insert into BigQuery. Hourly aggregates
+    are only built by the batch worker (--mode raw): a per-instance
+    aggregator here would see a fraction of each hour.
+    """
+    payload = base64.b64decode(event["data"]).decode("utf-8")
+    row = raw_record_to_row(json.loads(payload))
+
+    # the event is acked when this returns, so nothing may stay buffered
+    writer.write_through(table_ref, [row])
 
 
 @router.get("/predictions")
-def get_predictions(limit: int = 50):
-    """Fetch latest anomaly predictions from BigQuery."""
+async def get_predictions(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, description=f"Page size (at most {PREDICTIONS_MAX_PAGE_SIZE})"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    equipment: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None, description="prediction_time >= start"),
+    end: Optional[datetime] = Query(None, description="prediction_time < end"),
+    fmt: Optional[str] = Query(None, alias="format", description="json, ndjson or arrow (default: from Accept)"),
+):
+    """
+    Latest anomaly predictions, newest first, one keyset page at a time.
+    Pages inside the hot tier's window come from memory, the rest from
+    BigQuery. NDJSON and Arrow pages from BigQuery are streamed as they
+    arrive; streamed pages end with their next_cursor (see utils/streaming.py).
+    """
+    fmt = negotiate_format(request, fmt)
+    limit = min(limit, PREDICTIONS_MAX_PAGE_SIZE)
+    try:
+        columns = select_prediction_columns(fields)
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def page_cursor(last: Optional[dict], count: int) -> Optional[str]:
+        # a short page is the last one
+        return row_cursor(last) if count == limit else None
+
+    rows = hot_store.latest(columns, limit, equipment=equipment, start=start, end=end, before=position)
+    if rows is not None:
+        if fmt != JSON:
+            return streaming_response(
+                fmt, batches_from_rows(rows), headers={"X-Data-Source": "memory"}, next_cursor=page_cursor
+            )
+        response.headers["X-Data-Source"] = "memory"
+        return {"predictions": rows, "next_cursor": page_cursor(rows[-1] if rows else None, len(rows))}
+
+    # rows without a prediction_time have no keyset position to page from
+    where = ["prediction_time IS NOT NULL"]
+    params = [bigquery.ScalarQueryParameter("limit", "INT64", limit)]
+    if equipment:
+        where.append("equipment = @equipment")
+        params.append(bigquery.ScalarQueryParameter("equipment", "STRING", equipment))
+    if start:
+        where.append("prediction_time >= @start")
+        params.append(bigquery.ScalarQueryParameter("start", "TIMESTAMP", start))
+    if end:
+        where.append("prediction_time < @end")
+        params.append(bigquery.ScalarQueryParameter("end", "TIMESTAMP", end))
+    if position:
+        where.append(BEFORE_CURSOR_SQL)
+        params += [
+            bigquery.ScalarQueryParameter("cursor_time", "TIMESTAMP", position[0]),
+            bigquery.ScalarQueryParameter("cursor_seq", "INT64", position[1]),
+        ]
+
     query = f"""
-        SELECT *
-        FROM `cement-operations-optimization.plant.cement_predictions`
-        ORDER BY prediction_time DESC
-        LIMIT {limit}
+        SELECT {", ".join(columns)}
+        FROM `{BQ_PROJECT}.{BQ_DATASET}.{PREDICTIONS_TABLE}`
+        WHERE {" AND ".join(where)}
+        ORDER BY prediction_time DESC, seq_id DESC
+        LIMIT @limit
     """
-    query_job = client.query(query)
-    rows = [dict(row) for row in query_job]
-    return {"predictions": rows}
+    try:
+        if fmt != JSON:
+            batches = await prefetch(bq_executor.stream(query, params, label="predictions"))
+            return streaming_response(fmt, batches, headers={"X-Data-Source": "bigquery"}, next_cursor=page_cursor)
+        rows = await bq_executor.query(query, params, label="predictions")
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    response.headers["X-Data-Source"] = "bigquery"
+    return {"predictions": rows, "next_cursor": page_cursor(rows[-1] if rows else None, len(rows))}
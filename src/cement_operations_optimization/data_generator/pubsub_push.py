@@ -2,12 +2,11 @@
 import base64
 import json
 from fastapi import APIRouter, Request, Header, HTTPException
-from typing import Set
-import asyncio
+from cement_operations_optimization.utils.ws_broadcaster import Broadcaster
 
 router = APIRouter()
-# global set maintained by your websocket endpoint
-connected_websockets = set()
+# clients registered by the /ws/data websocket endpoint
+data_broadcaster = Broadcaster("data")
 
 @router.post("/pubsub/push")
 async def pubsub_push(request: Request, x_goog_resource_state: str | None = Header(None)):
@@ -33,15 +32,6 @@ async def pubsub_push(request: Request, x_goog_resource_state: str | None = Head
     return {"status": "ok"}
 
 async def broadcast_to_websockets(payload):
-    print(f"Broadcasting to {len(connected_websockets)} websockets: {payload}")
-    dead = []
-    for ws in list(connected_websockets):
-        try:
-            await ws.send_text(json.dumps(payload))
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        try:
-            connected_websockets.remove(ws)
-        except KeyError:
-            pass
+    # only enqueues: a slow client cannot hold up the Pub/Sub ack
+    print(f"Broadcasting to {len(data_broadcaster)} websockets: {payload}")
+    data_broadcaster.broadcast(payload)
@@ -1,28 +1,148 @@
 import psycopg2
+from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 import os
+import time
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_db_connection():
-    if os.getenv("K_SERVICE"):  
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_CHECKOUT_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT_SECONDS", "5"))
+# borrowed connections idle longer than this are pinged first; 0 pings every time
+DB_POOL_PING_IDLE_SECONDS = float(os.getenv("DB_POOL_PING_IDLE_SECONDS", "30"))
+
+
+def _db_config() -> dict:
+    if os.getenv("K_SERVICE"):
         # Running in Cloud Run
-        DB_CONFIG = {
+        return {
             'dbname': os.getenv("POSTGRES_DB", "cement-postgres"),
             'user': os.getenv("POSTGRES_USER", "cementuser"),
             'password': os.getenv("POSTGRES_PASSWORD"),
             'host': f"/cloudsql/{os.getenv('INSTANCE_CONNECTION_NAME')}"
         }
-    else:
-        # Running locally (fall back to TCP host)
-        DB_CONFIG = {
-            'dbname': os.getenv("POSTGRES_DB", "cement-postgres"),
-            'user': os.getenv("POSTGRES_USER", "cementuser"),
-            'password': os.getenv("POSTGRES_PASSWORD"),
-            'host': os.getenv("POSTGRES_HOST", "localhost"),
-            'port': int(os.getenv("POSTGRES_PORT", 5432))
-        }
+    # Running locally (fall back to TCP host)
+    return {
+        'dbname': os.getenv("POSTGRES_DB", "cement-postgres"),
+        'user': os.getenv("POSTGRES_USER", "cementuser"),
+        'password': os.getenv("POSTGRES_PASSWORD"),
+        'host': os.getenv("POSTGRES_HOST", "localhost"),
+        'port': int(os.getenv("POSTGRES_PORT", 5432))
+    }
+
+
+def get_db_connection():
+    """A new, unpooled connection (scripts and one-off jobs); the API uses db_connection()."""
+    return psycopg2.connect(**_db_config(), cursor_factory=RealDictCursor)
+
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Process-wide psycopg2 pool. Borrowers wait up to checkout_timeout for a
+    free connection instead of failing straight away, and connections idle
+    longer than ping_idle_seconds are checked with SELECT 1 (and replaced
+    if dead) before being handed out.
+    """
+
+    def __init__(
+        self,
+        minconn: int = DB_POOL_MIN,
+        maxconn: int = DB_POOL_MAX,
+        checkout_timeout: float = DB_POOL_CHECKOUT_TIMEOUT_SECONDS,
+        ping_idle_seconds: float = DB_POOL_PING_IDLE_SECONDS,
+    ):
+        self.checkout_timeout = checkout_timeout
+        self.ping_idle_seconds = ping_idle_seconds
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **_db_config(), cursor_factory=RealDictCursor)
+        # ThreadedConnectionPool raises when exhausted; the semaphore makes borrowers wait
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._returned_at = {}
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolTimeoutError(f"No database connection free within {self.checkout_timeout:.1f}s")
+        try:
+            conn = self._pool.getconn()
+            if not self._healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken: bool = False):
+        try:
+            broken = broken or bool(conn.closed)
+            if broken:
+                self._returned_at.pop(id(conn), None)
+            else:
+                self._returned_at[id(conn)] = time.monotonic()
+            # psycopg2 rolls back a connection returned mid-transaction
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._returned_at.get(id(conn), 0.0)
+        if idle < self.ping_idle_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a pooled connection; it goes back to the pool when the block
+    ends. Connection-level errors discard it instead.
+    """
+    p = get_pool()
+    conn = p.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        p.putconn(conn, broken=broken)
+
 
-    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
-    return conn
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
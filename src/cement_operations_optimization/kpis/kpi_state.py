@@ -0,0 +1,112 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from cement_operations_optimization.ml_train_deploy.streaming_features import parse_timestamp
+
+KPI_FIELDS = ["avg_power", "avg_temperature", "avg_emissions", "avg_fineness", "avg_residue", "is_anomaly"]
+KPI_HOURS = 168
+
+
+class _HourBucket:
+    __slots__ = ("hour", "sums", "counts")
+
+    def __init__(self, hour: int = -1):
+        self.hour = hour
+        self.sums = [0.0] * len(KPI_FIELDS)
+        self.counts = [0] * len(KPI_FIELDS)
+
+
+class KpiState:
+    """
+    Rolling per-hour sums/counts of the KPI columns for the last `hours`
+    hours of cement_predictions, kept in a ring indexed by hour.
+
+    add_row is O(1); snapshot() reproduces the /kpis query (average of the
+    hourly averages over the window) in O(hours).
+    """
+
+    def __init__(self, hours: int = KPI_HOURS):
+        self.hours = hours
+        self.ready = False
+        self._ring = [_HourBucket() for _ in range(hours)]
+        self._lock = threading.Lock()
+
+    def _bucket(self, hour: int) -> Optional[_HourBucket]:
+        b = self._ring[hour % self.hours]
+        if b.hour != hour:
+            if b.hour > hour:
+                return None  # older than the window
+            b.hour = hour
+            b.sums = [0.0] * len(KPI_FIELDS)
+            b.counts = [0] * len(KPI_FIELDS)
+        return b
+
+    def add_row(self, row: dict):
+        ts = row.get("prediction_time") or row.get("timestamp")
+        if ts is None:
+            return
+        hour = int(parse_timestamp(ts).timestamp() // 3600)
+        with self._lock:
+            b = self._bucket(hour)
+            if b is None:
+                return
+            for i, f in enumerate(KPI_FIELDS):
+                v = row.get(f)
+                if v is not None:
+                    b.sums[i] += float(v)
+                    b.counts[i] += 1
+
+    def add_rows(self, rows: Iterable[dict]):
+        for row in rows:
+            self.add_row(row)
+
+    def load_hourly(self, rows: Iterable[dict]):
+        """
+        Replace buckets with pre-aggregated hours (backfill). Each row has
+        hour_bucket plus sum_<field> and n_<field> for every KPI field.
+        """
+        with self._lock:
+            for r in rows:
+                hour = int(parse_timestamp(r["hour_bucket"]).timestamp() // 3600)
+                b = self._bucket(hour)
+                if b is None:
+                    continue
+                b.sums = [float(r[f"sum_{f}"] or 0.0) for f in KPI_FIELDS]
+                b.counts = [int(r[f"n_{f}"] or 0) for f in KPI_FIELDS]
+            self.ready = True
+
+    def snapshot(self, now: Optional[datetime] = None) -> Dict[str, Optional[float]]:
+        """Average over hours of each hourly average; None where there is no data."""
+        now_hour = int((now or datetime.now(timezone.utc)).timestamp() // 3600)
+        oldest = now_hour - self.hours
+        totals = [0.0] * len(KPI_FIELDS)
+        n_hours = [0] * len(KPI_FIELDS)
+        with self._lock:
+            for b in self._ring:
+                if not (oldest < b.hour <= now_hour):
+                    continue
+                for i in range(len(KPI_FIELDS)):
+                    if b.counts[i]:
+                        totals[i] += b.sums[i] / b.counts[i]
+                        n_hours[i] += 1
+        return {
+            f: (totals[i] / n_hours[i] if n_hours[i] else None)
+            for i, f in enumerate(KPI_FIELDS)
+        }
+
+
+def backfill_query(table: str) -> str:
+    """Hourly sums/counts for the last KPI_HOURS hours, the shape load_hourly expects."""
+    cols = ",\n            ".join(
+        f"SUM({f}) AS sum_{f}, COUNT({f}) AS n_{f}" for f in KPI_FIELDS
+    )
+    return f"""
+        SELECT
+            TIMESTAMP_TRUNC(prediction_time, HOUR) AS hour_bucket,
+            {cols}
+        FROM `{table}`
+        WHERE prediction_time > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {KPI_HOURS} HOUR)
+        GROUP BY hour_bucket
+    """
+
@@ -1,6 +1,10 @@
 import os
-from fastapi import APIRouter
-from google.cloud import bigquery
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Response
+from cement_operations_optimization.utils.bq_executor import QueryTimeoutError, bq_executor
+from cement_operations_optimization.utils.ttl_cache import AsyncTTLCache
+from cement_operations_optimization.kpis.kpi_state import KpiState, backfill_query
+from cement_operations_optimization.utils.prediction_feed import feed_subscriber
 
 router = APIRouter(tags=["KPIs"])
 
@@ -8,14 +12,76 @@ PROJECT_ID = os.getenv("GCP_PROJECT", "cement-operations-optimization")
 BQ_DATASET = "plant"
 PREDICTIONS_TABLE = "cement_predictions"
 
-bq_client = bigquery.Client()
+KPIS_CACHE_TTL_SECONDS = float(os.getenv("KPIS_CACHE_TTL_SECONDS", "300"))
+KPIS_CACHE_STALE_SECONDS = float(os.getenv("KPIS_CACHE_STALE_SECONDS", "3600"))
+
+kpis_cache = AsyncTTLCache(KPIS_CACHE_TTL_SECONDS, stale_seconds=KPIS_CACHE_STALE_SECONDS)
+kpi_state = KpiState()
+
+async def _start_prediction_feed():
+    """Backfill the hourly buckets from BigQuery, then follow the prediction feed."""
+    backfill_started = datetime.now(timezone.utc)
+    rows = await bq_executor.query(
+        backfill_query(f"{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}"), label="kpis_backfill", timeout=120
+    )
+    kpi_state.load_hourly(rows)
+    print("KPI state backfilled from BigQuery")
+
+    def on_rows(rows, publish_time):
+        # rows published before the backfill query started are already counted
+        if publish_time >= backfill_started:
+            kpi_state.add_rows(rows)
+
+    # the app starts feed_subscriber once every consumer is registered
+    feed_subscriber.add_handler(on_rows)
+
+# router startup handlers can run twice (FastAPI >= 0.112 also runs them
+# through the router's merged lifespan); backfill and subscribe only once
+_kpi_state_started = False
+
+@router.on_event("startup")
+async def start_kpi_state():
+    global _kpi_state_started
+    if _kpi_state_started:
+        return
+    _kpi_state_started = True
+    if feed_subscriber.enabled:
+        try:
+            await _start_prediction_feed()
+        except Exception as e:
+            print("KPI state disabled, falling back to cached query:", e)
 
 @router.get("/kpis")
-def get_kpis():
+async def get_kpis(response: Response):
     """
-    Aggregate key KPIs from BigQuery and return JSON for dashboard
+    Aggregate key KPIs from BigQuery and return JSON for dashboard.
+    Every user gets the same answer, so one cached result serves all of them.
+    The live in-memory numbers are only used while the prediction feed is
+    being followed; otherwise they would be frozen.
     """
+    if kpi_state.ready and feed_subscriber.following:
+        response.headers["X-Cache"] = "LIVE"
+        snap = kpi_state.snapshot()
+        return format_kpis({
+            "see": snap["avg_power"],
+            "ste": snap["avg_temperature"],
+            "co2_per_ton": snap["avg_emissions"],
+            "blaine": snap["avg_fineness"],
+            "residue": snap["avg_residue"],
+            "out_of_spec_pct": snap["is_anomaly"] * 100 if snap["is_anomaly"] is not None else None,
+        })
+
+    try:
+        kpis, status, age = await kpis_cache.get("kpis", query_kpis)
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    response.headers["X-Cache"] = status
+    response.headers["Age"] = str(int(age))
+    response.headers["Cache-Control"] = f"max-age={max(int(KPIS_CACHE_TTL_SECONDS - age), 0)}"
+    return kpis
 
+async def query_kpis():
+    """Run the 7-day KPI aggregation in BigQuery."""
     query = f"""
     WITH base AS (
         SELECT
@@ -42,9 +108,10 @@ def get_kpis():
     FROM base
     """
 
-    job = bq_client.query(query)
-    row = list(job.result())[0]
+    rows = await bq_executor.query(query, label="kpis")
+    return format_kpis(rows[0])
 
+def format_kpis(row) -> dict:
     return {
         "energy": {
             "see": row["see"],
@@ -1,4 +1,5 @@
 from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from cement_operations_optimization.auth.main import router as auth_router
 from cement_operations_optimization.data_generator.cement_data_service import router as data_router
@@ -8,6 +9,11 @@ from cement_operations_optimization.data_generator.main import router as predict
 from cement_operations_optimization.utils.alerts_service_async import router as alerts_router
 from cement_operations_optimization.trends.trends import router as trends_router
 from cement_operations_optimization.kpis.kpis import router as kpis_router
+from cement_operations_optimization.utils.bq_executor import bq_executor
+from cement_operations_optimization.utils.prediction_feed import feed_subscriber
+from cement_operations_optimization.utils import metrics
+from cement_operations_optimization.db import close_pool
+from cement_operations_optimization.utils.password_hasher import password_hasher
 
 app = FastAPI(title="Cement Plant AI API")
 
@@ -24,6 +30,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# registered before the routers: each instance's feed subscription must exist,
+# and buffer rows, before their startup backfills query BigQuery
+@app.on_event("startup")
+def create_prediction_feed_subscription():
+    feed_subscriber.create_subscription()
+
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 
 app.include_router(predictions_router, prefix="/ml", tags=["ML"])
@@ -37,6 +49,24 @@ app.include_router(kpis_router)
 def home():
     return {"message": "Cement Plant API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of the in-process metrics (BigQuery cost and latency, ...)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# registered after the routers, so it runs once their backfills have added
+# their feed handlers
+@app.on_event("startup")
+def start_prediction_feed():
+    feed_subscriber.start()
+
+@app.on_event("shutdown")
+def close_background_clients():
+    feed_subscriber.stop()
+    bq_executor.close()
+    close_pool()
+    password_hasher.close()
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import math
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+COMPILED_MODEL_FILENAME = "model_compiled.npz"
+
+
+def export_compiled(pipeline, path: str, feature_order: Sequence[str] = None) -> str:
+    """
+    Fold the DictVectorizer → SimpleImputer → StandardScaler → LogisticRegression
+    pipeline from train_xgb.build_pipeline into one affine map:
+
+        p = sigmoid(w · x + b),  w = coef / scale,  b = intercept - Σ coef·mean/scale
+
+    Missing (None/NaN) values are replaced by the imputer medians before the
+    dot product; features absent from a dict count as 0, as with DictVectorizer.
+    """
+    steps = pipeline.named_steps
+    names = list(steps["dictvec"].feature_names_)
+    if any("=" in n for n in names):
+        raise ValueError("Compiled scorer only supports numeric features; found one-hot columns")
+
+    fill = np.asarray(steps["imputer"].statistics_, dtype=np.float64)
+    scaler = steps["scaler"]
+    mean = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(len(names)), dtype=np.float64)
+    scale = np.asarray(scaler.scale_ if scaler.with_std else np.ones(len(names)), dtype=np.float64)
+    lr = steps["lr"]
+    if lr.coef_.shape[0] != 1:
+        raise ValueError("Compiled scorer only supports binary LogisticRegression")
+    coef = np.asarray(lr.coef_[0], dtype=np.float64)
+
+    weights = coef / scale
+    bias = float(lr.intercept_[0] - np.sum(coef * mean / scale))
+
+    if feature_order:
+        idx = [names.index(n) for n in feature_order]
+        names = list(feature_order)
+        weights, fill = weights[idx], fill[idx]
+
+    np.savez(path, feature_names=np.array(names), weights=weights, bias=np.array([bias]), fill=fill)
+    return path
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class CompiledScorer:
+    """NumPy-only logistic scorer produced by export_compiled; no sklearn import."""
+
+    def __init__(self, feature_names: Sequence[str], weights, bias: float, fill):
+        self.feature_names = [str(n) for n in feature_names]
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.fill = np.asarray(fill, dtype=np.float64)
+        # plain-Python copies keep single-row scoring free of NumPy call overhead
+        self._rows = list(zip(self.feature_names, self.weights.tolist(), self.fill.tolist()))
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledScorer":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["feature_names"].tolist(), data["weights"], data["bias"][0], data["fill"])
+
+    def predict_proba_one(self, instance: Dict[str, float]) -> float:
+        z = self.bias
+        for name, w, fill in self._rows:
+            v = instance.get(name, 0.0)
+            if v is None or v != v:  # None or NaN -> imputer median
+                v = fill
+            z += w * v
+        return _sigmoid(z)
+
+    def to_matrix(self, instances: List[Dict[str, float]]) -> np.ndarray:
+        return np.array(
+            [[inst.get(n, 0.0) for n in self.feature_names] for inst in instances],
+            dtype=np.float64,
+        )
+
+    def predict_proba(self, X: Union[np.ndarray, List[Dict[str, float]]]) -> np.ndarray:
+        """Positive-class probability for a batch (dicts, or rows in feature_names order)."""
+        if not isinstance(X, np.ndarray):
+            X = self.to_matrix(X)
+        X = np.where(np.isnan(X), self.fill, X)
+        z = X @ self.weights + self.bias
+        return np.exp(-np.logaddexp(0.0, -z))
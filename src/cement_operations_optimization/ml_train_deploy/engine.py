@@ -0,0 +1,252 @@
+import os
+import json
+import base64
+import asyncio
+from collections.abc import Mapping, Sequence
+from typing import Callable, List, Optional
+
+from cement_operations_optimization.ml_train_deploy.streaming_features import FEATURE_COLS
+
+# One threshold, feature set and output parser for every inference path
+# (ml_train_deploy/main.py, vertex_inference.py, data_generator/pubsub_infer.py).
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "0.5"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "1000"))
+PREDICT_WORKERS = int(os.getenv("PIPELINE_PREDICT_WORKERS", "4"))
+PREDICT_BATCH_SIZE = int(os.getenv("PIPELINE_PREDICT_BATCH_SIZE", "64"))
+
+_REQUIRED = [c for c in FEATURE_COLS if c.startswith("avg_")]
+
+
+def build_instance(payload: dict) -> dict:
+    """
+    The 16 model features from an enriched payload. The hourly avg_* values
+    are required; lag/rolling/trend features default to 0.0 when absent.
+    """
+    instance = {}
+    for k in FEATURE_COLS:
+        v = payload[k] if k in _REQUIRED else payload.get(k)
+        instance[k] = float(v) if v is not None else 0.0
+    return instance
+
+
+def to_plain(value):
+    """
+    Plain dicts/lists from a prediction value. The gapic client returns
+    proto-plus MapComposite/RepeatedComposite, which are Mappings and
+    Sequences but not dicts and lists (list() of a map keeps only its keys).
+    """
+    if isinstance(value, Mapping):
+        return {k: to_plain(v) for k, v in value.items()}
+    if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def parse_anomaly_prob(pred) -> float:
+    """
+    Positive-class probability from one Vertex prediction, whatever the
+    serving container returned: {"anomaly_prob": p}, {"probabilities": [...]},
+    {"scores": [...]}, [p0, p1] or a bare number. Proto-plus maps and
+    repeated values are accepted as well.
+    """
+    pred = to_plain(pred)
+    if isinstance(pred, dict):
+        if "anomaly_prob" in pred:
+            return float(pred["anomaly_prob"])
+        for key in ("probabilities", "scores"):
+            if key in pred:
+                return float(pred[key][-1])
+        raise ValueError(f"Unrecognised prediction: {pred!r}")
+    if isinstance(pred, list):
+        if not pred:
+            raise ValueError("Empty prediction")
+        return float(pred[-1])  # last entry is the positive class
+    return float(pred)
+
+
+def is_anomalous(anomaly_prob: float) -> int:
+    return int(anomaly_prob >= ANOMALY_THRESHOLD)
+
+
+def decode_event(event: dict) -> Optional[dict]:
+    """Cloud Function / push style event → payload dict (None if empty)."""
+    data = event.get("data")
+    if not data:
+        return None
+    return json.loads(base64.b64decode(data).decode("utf-8"))
+
+
+# ---------------------------
+# Pipelined engine
+# ---------------------------
+class PipelineError(RuntimeError):
+    def __init__(self, errors: list):
+        super().__init__(f"{len(errors)} pipeline stage failure(s): {errors[0][1]!r}")
+        self.errors = errors
+
+
+class PipelineStage:
+    """
+    One step of the inference pipeline. fn takes a list of items and returns
+    the items to pass on. Each of the `workers` tasks takes up to batch_size
+    items that are already queued, so network stages get both overlap across
+    messages and batching. Blocking functions run in a worker thread.
+    """
+
+    def __init__(self, name: str, fn: Callable[[list], list], workers: int = 1, batch_size: int = 1, blocking: bool = False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.blocking = blocking
+
+
+class InferencePipeline:
+    """
+    Runs stages concurrently on asyncio with a bounded queue in front of each
+    stage, so a slow stage applies backpressure to submit() instead of
+    buffering without limit.
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._outputs: list = []
+        self._errors: list = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        for i, stage in enumerate(self.stages):
+            for w in range(stage.workers):
+                self._tasks.append(asyncio.create_task(self._worker(i, stage), name=f"{stage.name}-{w}"))
+
+    async def submit(self, item):
+        await self._queues[0].put(item)
+
+    async def join(self):
+        # an item is put on the next queue before it is marked done on this one
+        for q in self._queues:
+            await q.join()
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def process(self, items: list) -> list:
+        """Push items through every stage; returns the final stage's output."""
+        await self.start()
+        for item in items:
+            await self.submit(item)
+        await self.join()
+        outputs, self._outputs = self._outputs, []
+        errors, self._errors = self._errors, []
+        if errors:
+            raise PipelineError(errors)
+        return outputs
+
+    async def _worker(self, index: int, stage: PipelineStage):
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        while True:
+            batch = [await inbox.get()]
+            while len(batch) < stage.batch_size and not inbox.empty():
+                batch.append(inbox.get_nowait())
+            try:
+                if stage.blocking:
+                    out = await asyncio.to_thread(stage.fn, batch)
+                else:
+                    out = stage.fn(batch)
+                for item in out or []:
+                    if outbox is not None:
+                        await outbox.put(item)
+                    else:
+                        self._outputs.append(item)
+            except Exception as e:
+                print(f"Pipeline stage {stage.name} failed for {len(batch)} items: {e}")
+                self._errors.append((stage.name, e))
+            finally:
+                for _ in batch:
+                    inbox.task_done()
+
+
+def default_stages(live: bool = False) -> List[PipelineStage]:
+    """
+    decode → features → predict → sink → alerts, wired to the shared clients
+    in ml_train_deploy/main.py. Items are raw message bytes or payload dicts.
+    With live=True, payloads are raw cement-raw records and features come
+    from the streaming feature engine.
+    """
+    from cement_operations_optimization.ml_train_deploy import main as infer
+
+    table = f"{infer.PROJECT_ID}.{infer.BQ_DATASET}.{infer.PREDICTIONS_TABLE}"
+    features_engine = None
+    if live:
+        from cement_operations_optimization.ml_train_deploy.streaming_features import StreamingFeatureEngine
+        features_engine = StreamingFeatureEngine()
+
+    def decode(items: list) -> list:
+        out = []
+        for data in items:
+            try:
+                out.append(json.loads(data) if isinstance(data, (bytes, str)) else data)
+            except Exception as e:
+                print("Dropping undecodable message:", e)
+        return out
+
+    def features(payloads: list) -> list:
+        out = []
+        for payload in payloads:
+            try:
+                if features_engine is not None:
+                    payload = features_engine.update(payload)
+                    if payload is None:
+                        continue
+                out.append({"payload": payload, "instance": build_instance(payload)})
+            except (KeyError, TypeError, ValueError) as e:
+                print("Dropping payload without feature:", e)
+        return out
+
+    def predict(items: list) -> list:
+        results = infer.run_prediction_batch([i["instance"] for i in items])
+        failed = [(item, error) for item, (_, _, error) in zip(items, results) if error is not None]
+        if failed:
+            # raising fails the batch, so its messages are nacked instead of acked unscored
+            item, error = failed[0]
+            raise RuntimeError(
+                f"{len(failed)} of {len(items)} predictions failed "
+                f"(first: {item['payload'].get('equipment')}: {error})"
+            )
+        for item, (is_anomaly, anomaly_prob, _) in zip(items, results):
+            item["is_anomaly"], item["anomaly_prob"] = is_anomaly, anomaly_prob
+        return items
+
+    def sink(items: list) -> list:
+        rows = [
+            infer.build_prediction_row(i["payload"], i["instance"], i["is_anomaly"], i["anomaly_prob"])
+            for i in items
+        ]
+        # raises InsertError if any row was not written, which fails the batch
+        infer.bq_writer.write_through(table, rows)
+        infer.prediction_feed.publish(rows)
+        return items
+
+    def alerts(items: list) -> list:
+        for i in items:
+            if i["is_anomaly"]:
+                infer.publish_anomaly_alert(i["payload"]["equipment"], i["anomaly_prob"])
+        return items
+
+    return [
+        PipelineStage("decode", decode),
+        # the streaming feature engine keeps per-equipment order, so one worker
+        PipelineStage("features", features),
+        PipelineStage("predict", predict, workers=PREDICT_WORKERS, batch_size=PREDICT_BATCH_SIZE, blocking=True),
+        PipelineStage("sink", sink, workers=2, batch_size=500, blocking=True),
+        PipelineStage("alerts", alerts, blocking=True),
+    ]
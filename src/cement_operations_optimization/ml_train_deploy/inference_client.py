@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, List, Optional
+
+LATENCY_BUDGET_SECONDS = float(os.getenv("VERTEX_LATENCY_BUDGET_SECONDS", "0.5"))
+SLOW_CALL_SECONDS = float(os.getenv("VERTEX_SLOW_CALL_SECONDS", str(LATENCY_BUDGET_SECONDS * 0.8)))
+FAILURE_THRESHOLD = int(os.getenv("VERTEX_BREAKER_FAILURES", "5"))
+PROBE_INTERVAL_SECONDS = float(os.getenv("VERTEX_PROBE_INTERVAL_SECONDS", "15"))
+MAX_CONCURRENCY = int(os.getenv("VERTEX_MAX_CONCURRENCY", "8"))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling Vertex while the breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures or slow calls. While
+    open no traffic is sent; InferenceClient probes in the background and
+    closes the breaker on the first healthy probe.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, slow_call_seconds: float = SLOW_CALL_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return self.state == self.CLOSED
+
+    def record(self, ok: bool, latency: float) -> bool:
+        """Record one call; returns True if this call opened the breaker."""
+        bad = not ok or latency > self.slow_call_seconds
+        with self._lock:
+            if not bad:
+                self.consecutive_failures = 0
+                return False
+            self.consecutive_failures += 1
+            if self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def close(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+
+class InferenceClient:
+    """
+    Long-lived Vertex endpoint client shared by every prediction in the process.
+
+    The endpoint object is created once. Each call gets at most
+    budget_seconds; a slower or failing call raises so the caller can use the
+    local scorer, and repeated failures open the circuit breaker so callers
+    fail over immediately instead of waiting on the endpoint. While open, a
+    background thread re-probes the endpoint every probe_interval_seconds.
+    """
+
+    def __init__(
+        self,
+        endpoint_factory: Callable[[], object],
+        budget_seconds: float = LATENCY_BUDGET_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+        probe_interval_seconds: float = PROBE_INTERVAL_SECONDS,
+        max_concurrency: int = MAX_CONCURRENCY,
+    ):
+        self.endpoint_factory = endpoint_factory
+        self.budget_seconds = budget_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.probe_interval_seconds = probe_interval_seconds
+        self.calls = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+        self._endpoint = None
+        self._endpoint_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vertex")
+        self._probe_instances: Optional[list] = None
+        self._probe_thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self):
+        if self._endpoint is None:
+            with self._endpoint_lock:
+                if self._endpoint is None:
+                    self._endpoint = self.endpoint_factory()
+        return self._endpoint
+
+    def _call(self, instances: list):
+        return self.endpoint.predict(instances=instances, timeout=self.budget_seconds)
+
+    def predict(self, instances: List[dict]):
+        """Vertex prediction for instances, or raise (CircuitOpenError, TimeoutError, API error)."""
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpenError("Vertex circuit open")
+
+        self.calls += 1
+        start = time.monotonic()
+        future = self._pool.submit(self._call, instances)
+        try:
+            result = future.result(timeout=self.budget_seconds)
+        except FutureTimeout:
+            future.cancel()
+            self._failed(instances, time.monotonic() - start)
+            raise TimeoutError(f"Vertex call exceeded {self.budget_seconds}s budget")
+        except Exception:
+            self._failed(instances, time.monotonic() - start)
+            raise
+
+        latency = time.monotonic() - start
+        self._probe_instances = instances[:1]
+        if self.breaker.record(True, latency):
+            self._start_probe()
+        return result
+
+    def _failed(self, instances: list, latency: float):
+        self.failures += 1
+        if self._probe_instances is None:
+            self._probe_instances = instances[:1]
+        if self.breaker.record(False, latency):
+            self._start_probe()
+
+    def _start_probe(self):
+        print(f"Vertex circuit opened after {self.breaker.consecutive_failures} bad calls; using local scorer")
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="vertex-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self.breaker.allow():
+            time.sleep(self.probe_interval_seconds)
+            start = time.monotonic()
+            try:
+                self._pool.submit(self._call, self._probe_instances or []).result(timeout=self.budget_seconds)
+            except Exception as e:
+                print("Vertex probe failed:", e)
+                continue
+            if time.monotonic() - start <= self.breaker.slow_call_seconds:
+                self.breaker.close()
+                print("Vertex probe succeeded; circuit closed")
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+        }
@@ -1,95 +1,200 @@
 import os
 import json
-import base64
-import joblib
+from typing import Optional
 import numpy as np
 from google.cloud import aiplatform
 from google.cloud import bigquery, pubsub_v1
+from cement_operations_optimization.utils.bq_writer import BatchingRowWriter
+from cement_operations_optimization.ml_train_deploy.compiled_scorer import COMPILED_MODEL_FILENAME, CompiledScorer
+from cement_operations_optimization.ml_train_deploy.inference_client import CircuitOpenError, InferenceClient
+from cement_operations_optimization.ml_train_deploy import engine
+from cement_operations_optimization.utils.alert_coalescer import AlertCoalescer
+from cement_operations_optimization.utils.prediction_feed import PredictionFeed
 
 # Config
 PROJECT_ID = os.getenv("GCP_PROJECT","cement-operations-optimization")
 LOCATION = os.getenv("VERTEX_REGION", "us-central1")  # default region
 ENDPOINT_ID = os.getenv("2269422786055241728")
+# full endpoint resource name (as used by the pubsub_infer function); overrides the above
+VERTEX_ENDPOINT = os.getenv("VERTEX_ENDPOINT")
 BQ_DATASET = "plant"
 PREDICTIONS_TABLE = "cement_predictions"
 ALERTS_TOPIC = "cement-alerts"
 
+
+def prediction_row_id(row: dict) -> Optional[str]:
+    """insertId of a prediction row: a redelivered reading is not stored twice."""
+    if row.get("seq_id") is None:
+        return None
+    return f"{row.get('equipment')}:{row['seq_id']}"
+
+
 # Clients
 bq_client = bigquery.Client()
+bq_writer = BatchingRowWriter(bq_client, row_id=prediction_row_id)
 publisher = pubsub_v1.PublisherClient()
+prediction_feed = PredictionFeed(publisher, PROJECT_ID)
+alerts = AlertCoalescer(
+    lambda msg: publisher.publish(f"projects/{PROJECT_ID}/topics/{ALERTS_TOPIC}", json.dumps(msg).encode("utf-8"))
+)
 
-# Try Vertex endpoint if configured
-endpoint = None
-if ENDPOINT_ID:
+# Vertex endpoint client, created once and shared by every prediction
+vertex_client = None
+if VERTEX_ENDPOINT or ENDPOINT_ID:
+    endpoint_name = VERTEX_ENDPOINT or f"projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/{ENDPOINT_ID}"
+    vertex_client = InferenceClient(lambda: aiplatform.Endpoint(endpoint_name=endpoint_name))
+    print(f"Using Vertex endpoint: {endpoint_name}")
+
+# Compiled scorer exported by train_xgb (NumPy only, preferred over local_model)
+COMPILED_MODEL_PATH = os.getenv("COMPILED_MODEL_PATH", COMPILED_MODEL_FILENAME)
+compiled_scorer = None
+if os.path.exists(COMPILED_MODEL_PATH):
     try:
-        endpoint = aiplatform.Endpoint(
-            endpoint_name=f"projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/{ENDPOINT_ID}"
-        )
-        print(f"Using Vertex endpoint: {ENDPOINT_ID}")
+        compiled_scorer = CompiledScorer.load(COMPILED_MODEL_PATH)
+        print(f"Loaded compiled scorer from {COMPILED_MODEL_PATH}")
     except Exception as e:
-        print(f"Could not init Vertex endpoint: {e}")
+        print(f"Error loading compiled scorer: {e}")
 
-# Local fallback model
+# Local fallback model, only without a compiled scorer: unpickling it imports sklearn
 LOCAL_MODEL_PATH = "cement_xgb_model.pkl"
 local_model = None
-if os.path.exists(LOCAL_MODEL_PATH):
+if compiled_scorer is None and os.path.exists(LOCAL_MODEL_PATH):
     try:
+        import joblib
+
         local_model = joblib.load(LOCAL_MODEL_PATH)
         print(f"Loaded local model from {LOCAL_MODEL_PATH}")
     except Exception as e:
         print(f"Error loading local model: {e}")
 
 
-def run_prediction(instance: dict):
-    """Run prediction via Vertex AI if available, else local model."""
-    # Try Vertex AI first
-    if endpoint:
+# Vertex online prediction rejects request bodies over ~1.5 MB
+VERTEX_MAX_INSTANCES = int(os.getenv("VERTEX_MAX_INSTANCES", "256"))
+VERTEX_MAX_PAYLOAD_BYTES = int(os.getenv("VERTEX_MAX_PAYLOAD_BYTES", str(1_400_000)))
+
+
+def _chunk_instances(indexed: list):
+    """Split [(i, instance), ...] into chunks under the Vertex count/payload limits."""
+    chunk, size = [], 0
+    for item in indexed:
+        n = len(json.dumps(item[1], default=str)) + 1
+        if chunk and (len(chunk) >= VERTEX_MAX_INSTANCES or size + n > VERTEX_MAX_PAYLOAD_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += n
+    if chunk:
+        yield chunk
+
+
+def _predict_vertex(indexed: list, results: list, raw: Optional[list] = None) -> list:
+    """Fill results for every instance Vertex answered; returns the ones it did not."""
+    remaining = []
+    for chunk in _chunk_instances(indexed):
         try:
-            prediction = endpoint.predict(instances=[instance])
-            is_anomaly = int(prediction.predictions[0]["is_anomaly"])
-            anomaly_prob = float(prediction.predictions[0]["anomaly_prob"])
-            return is_anomaly, anomaly_prob
+            prediction = vertex_client.predict([inst for _, inst in chunk])
+        except CircuitOpenError:
+            remaining.extend(chunk)
+            continue
         except Exception as e:
-            print(f"Vertex AI failed: {e}")
+            print(f"Vertex AI failed for {len(chunk)} instances: {e}")
+            remaining.extend(chunk)
+            continue
+        predictions = list(prediction.predictions)
+        for (i, inst), pred in zip(chunk, predictions):
+            try:
+                anomaly_prob = engine.parse_anomaly_prob(pred)
+                results[i] = (engine.is_anomalous(anomaly_prob), anomaly_prob, None)
+                if raw is not None:
+                    raw[i] = (pred, prediction)
+            except Exception as e:
+                print(f"Unexpected Vertex prediction {pred!r}: {e}")
+                remaining.append((i, inst))
+        if len(predictions) < len(chunk):
+            # zip stops at the shorter list; the unanswered tail goes to the fallback
+            print(f"Vertex AI answered {len(predictions)} of {len(chunk)} instances")
+            remaining.extend(chunk[len(predictions):])
+    return remaining
 
-    # Fallback to local model
-    if local_model:
-        X = np.array(list(instance.values())).reshape(1, -1)
-        pred = local_model.predict(X)
-        prob = (
-            local_model.predict_proba(X)[:, 1]
-            if hasattr(local_model, "predict_proba")
-            else [None]
-        )
-        return int(pred[0]), float(prob[0]) if prob[0] is not None else None
 
-    raise RuntimeError("No model available (Vertex or local).")
+def _local_features(instances: list):
+    steps = getattr(local_model, "named_steps", {})
+    if "dictvec" in steps:
+        return instances  # sklearn pipeline built by train_xgb takes feature dicts
+    return np.array([list(inst.values()) for inst in instances], dtype=float)
 
 
-def predict_and_store(event, context):
-    """Triggered by Pub/Sub event with enriched features."""
-    payload = json.loads(base64.b64decode(event["data"]).decode("utf-8"))
+def _predict_local(indexed: list, results: list):
+    valid = []
+    for i, inst in indexed:
+        try:
+            [float(v) for v in inst.values()]
+            valid.append((i, inst))
+        except (TypeError, ValueError) as e:
+            results[i] = (None, None, ValueError(f"non-numeric feature: {e}"))
+    if not valid:
+        return
 
-    # Prepare features for model
-    instance = {
-        "avg_temperature": payload["avg_temperature"],
-        "avg_pressure": payload["avg_pressure"],
-        "avg_vibration": payload["avg_vibration"],
-        "avg_power": payload["avg_power"],
-        "avg_emissions": payload["avg_emissions"],
-        "avg_fineness": payload["avg_fineness"],
-        "avg_residue": payload["avg_residue"],
-        "temp_lag_1h": payload.get("temp_lag_1h", 0),
-        "emissions_lag_1h": payload.get("emissions_lag_1h", 0),
-        "temp_roll_3h": payload.get("temp_roll_3h", 0),
-        "emissions_trend_3h": payload.get("emissions_trend_3h", 0),
-    }
+    try:
+        if compiled_scorer is not None:
+            probs = compiled_scorer.predict_proba([inst for _, inst in valid])
+            for (i, _), p in zip(valid, probs):
+                results[i] = (engine.is_anomalous(p), float(p), None)
+            return
 
-    # Run prediction (Vertex AI or local fallback)
-    is_anomaly, anomaly_prob = run_prediction(instance)
+        X = _local_features([inst for _, inst in valid])
+        # one vectorized pass; the class follows from the probability
+        if hasattr(local_model, "predict_proba"):
+            probs = local_model.predict_proba(X)[:, 1]
+            for (i, _), p in zip(valid, probs):
+                results[i] = (engine.is_anomalous(p), float(p), None)
+        else:
+            preds = local_model.predict(X)
+            for (i, _), p in zip(valid, preds):
+                results[i] = (int(p), None, None)
+    except Exception as e:
+        print(f"Local model failed for {len(valid)} instances: {e}")
+        for i, _ in valid:
+            results[i] = (None, None, e)
 
-    # Save to BigQuery
-    row = {
+
+def run_prediction_batch(instances: list, raw: Optional[list] = None) -> list:
+    """
+    Predict many instances at once: one Vertex call per chunk, with a single
+    vectorized local-model call for whatever Vertex could not answer.
+
+    Returns (is_anomaly, anomaly_prob, error) per instance, in input order;
+    error is None on success. If raw is a list of len(instances), it gets
+    (prediction, response) for every instance Vertex answered.
+    """
+    results = [None] * len(instances)
+    pending = list(enumerate(instances))
+
+    if vertex_client and pending:
+        pending = _predict_vertex(pending, results, raw)
+
+    if (compiled_scorer is not None or local_model is not None) and pending:
+        _predict_local(pending, results)
+        pending = []
+
+    for i, _ in pending:
+        results[i] = (None, None, RuntimeError("No model available (Vertex or local)."))
+    return results
+
+
+def run_prediction(instance: dict):
+    """Run prediction via Vertex AI if available, else local model."""
+    is_anomaly, anomaly_prob, error = run_prediction_batch([instance])[0]
+    if error is not None:
+        raise error
+    return is_anomaly, anomaly_prob
+
+
+build_instance = engine.build_instance
+
+
+def build_prediction_row(payload: dict, instance: dict, is_anomaly, anomaly_prob) -> dict:
+    return {
         "seq_id": payload["seq_id"],
         "equipment": payload["equipment"],
         **instance,
@@ -98,17 +203,27 @@ def predict_and_store(event, context):
         "prediction_time": payload["hour_bucket"],
     }
 
-    errors = bq_client.insert_rows_json(
-        f"{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}", [row]
-    )
-    if errors:
-        print(f"BigQuery insert errors: {errors}")
+
+def publish_anomaly_alert(equipment: str, anomaly_prob):
+    alerts.add({"equipment": equipment, "prob": anomaly_prob}, prob=anomaly_prob)
+
+
+def predict_and_store(event, context):
+    """Triggered by Pub/Sub event with enriched features."""
+    payload = engine.decode_event(event)
+
+    # Prepare features for model
+    instance = build_instance(payload)
+
+    # Run prediction (Vertex AI or local fallback)
+    is_anomaly, anomaly_prob = run_prediction(instance)
+
+    # Save to BigQuery
+    row = build_prediction_row(payload, instance, is_anomaly, anomaly_prob)
+    # the event is acked when this returns, so nothing may stay buffered
+    bq_writer.write_through(f"{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}", [row])
+    prediction_feed.publish([row])
 
     # If anomaly, publish alert
     if is_anomaly:
-        alert_msg = json.dumps(
-            {"equipment": payload["equipment"], "prob": anomaly_prob}
-        )
-        topic_path = f"projects/{PROJECT_ID}/topics/{ALERTS_TOPIC}"
-        publisher.publish(topic_path, alert_msg.encode("utf-8"))
-        print(f"Published anomaly alert: {alert_msg}")
+        publish_anomaly_alert(payload["equipment"], anomaly_prob)
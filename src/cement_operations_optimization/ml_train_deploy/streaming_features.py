@@ -0,0 +1,217 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RAW_METRICS = ["temperature", "pressure", "vibration", "power", "emissions", "fineness", "residue"]
+
+FEATURE_COLS = [
+    "avg_temperature", "avg_pressure", "avg_vibration", "avg_power", "avg_emissions",
+    "avg_fineness", "avg_residue",
+    "temp_lag_1h", "temp_lag_2h", "emissions_lag_1h", "emissions_lag_2h",
+    "temp_roll_3h", "temp_roll_6h", "emissions_roll_3h",
+    "temp_trend_3h", "emissions_trend_3h",
+]
+
+# enough hourly slots for the widest window (temp_roll_6h)
+HISTORY_HOURS = 6
+
+# windows over *previous* hours whose sums are cached at hour rollover;
+# the current hour is added on every reading
+_WINDOWS = {
+    "temperature": (3, 6),
+    "emissions": (3,),
+}
+_TREND_HOURS = 3
+
+_TEMP = RAW_METRICS.index("temperature")
+_EMIS = RAW_METRICS.index("emissions")
+
+
+def parse_timestamp(ts) -> datetime:
+    if isinstance(ts, datetime):
+        dt = ts
+    else:
+        dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def hour_index(ts) -> int:
+    """Whole hours since the epoch for a reading timestamp."""
+    return int(parse_timestamp(ts).timestamp() // 3600)
+
+
+class _HourSlot:
+    __slots__ = ("hour", "sums", "counts", "count", "seen")
+
+    def __init__(self, hour: int = -1):
+        self.hour = hour
+        self.sums = [0.0] * len(RAW_METRICS)
+        # per metric, so readings missing a metric do not pull its mean down
+        self.counts = [0] * len(RAW_METRICS)
+        self.count = 0
+        # reading times (µs) already counted, so a redelivered reading is not added twice
+        self.seen = set()
+
+    def mean(self, i: int) -> Optional[float]:
+        return self.sums[i] / self.counts[i] if self.counts[i] else None
+
+
+class _EquipmentState:
+    __slots__ = ("current", "slots", "prev")
+
+    def __init__(self, hour: int):
+        self.current = hour
+        self.slots = [_HourSlot() for _ in range(HISTORY_HOURS)]
+        # (metric index, window) -> (sum of previous-hour means, how many)
+        self.prev: Dict[tuple, tuple] = {}
+
+    def slot(self, hour: int) -> Optional[_HourSlot]:
+        s = self.slots[hour % HISTORY_HOURS]
+        return s if s.hour == hour and s.count else None
+
+    def reset_slot(self, hour: int):
+        s = self.slots[hour % HISTORY_HOURS]
+        s.hour = hour
+        s.sums = [0.0] * len(RAW_METRICS)
+        s.counts = [0] * len(RAW_METRICS)
+        s.count = 0
+        s.seen = set()
+
+    def hourly_mean(self, i: int, hour: int) -> Optional[float]:
+        s = self.slot(hour)
+        return s.mean(i) if s else None
+
+    def refresh_previous(self):
+        """Recompute cached sums over completed hours; runs once per rollover."""
+        for metric, windows in _WINDOWS.items():
+            i = RAW_METRICS.index(metric)
+            for w in windows:
+                total, n = 0.0, 0
+                for back in range(1, w):
+                    m = self.hourly_mean(i, self.current - back)
+                    if m is not None:
+                        total += m
+                        n += 1
+                self.prev[(i, w)] = (total, n)
+
+
+class StreamingFeatureEngine:
+    """
+    Turns raw cement-raw records into the 16 model features online.
+
+    Each equipment keeps a ring of HISTORY_HOURS hourly slots with running
+    sums/counts. avg_* are the running means of the reading's hour; lags are
+    the means of earlier hours; roll_Nh is the mean of hourly means over the
+    last N hours including the current one; trend_3h is the current hourly
+    mean minus the one three hours earlier. Per-reading work is constant:
+    sums over completed hours are cached when the hour rolls over.
+
+    Features that have no history yet are filled with missing_value (0.0,
+    the same default the inference handlers use).
+    """
+
+    def __init__(self, missing_value: Optional[float] = 0.0):
+        self.missing_value = missing_value
+        self._state: Dict[str, _EquipmentState] = {}
+
+    def update(self, record: dict) -> Optional[dict]:
+        """
+        Add one raw record and return the enriched feature payload for its
+        hour. Late readings only update history and return None. A reading
+        seen before (same equipment and timestamp, e.g. a redelivered
+        message) is not counted again.
+        """
+        equipment = record["equipment"]
+        metrics = record.get("metrics", record)
+        ts = parse_timestamp(record["timestamp"])
+        hour = int(ts.timestamp() // 3600)
+
+        st = self._state.get(equipment)
+        if st is None:
+            st = self._state[equipment] = _EquipmentState(hour)
+        if hour > st.current:
+            for h in range(max(st.current + 1, hour - HISTORY_HOURS + 1), hour + 1):
+                st.reset_slot(h)
+            st.current = hour
+            st.refresh_previous()
+        elif hour <= st.current - HISTORY_HOURS:
+            return None  # older than anything the features look at
+
+        slot = st.slots[hour % HISTORY_HOURS]
+        if slot.hour != hour:
+            st.reset_slot(hour)
+        seq_id = int(ts.timestamp() * 1_000_000)
+        counted = seq_id in slot.seen
+        if not counted:
+            slot.seen.add(seq_id)
+            for i, name in enumerate(RAW_METRICS):
+                v = metrics.get(name)
+                if v is not None:
+                    slot.sums[i] += float(v)
+                    slot.counts[i] += 1
+            slot.count += 1
+        if hour < st.current:
+            if not counted:
+                # a late reading changed a completed hour
+                st.refresh_previous()
+            return None
+
+        features = self._features(st)
+        features.update({
+            "equipment": equipment,
+            "seq_id": seq_id,
+            "hour_bucket": datetime.fromtimestamp(hour * 3600, tz=timezone.utc).isoformat(),
+        })
+        return features
+
+    def replay(self, records: Iterable[dict]) -> List[Tuple[dict, dict]]:
+        """
+        Run a historical batch through the engine in timestamp order and
+        return (record, features) for every reading that was scored, i.e.
+        exactly what serving would have computed for it (training parity).
+        """
+        ordered = sorted(records, key=lambda r: parse_timestamp(r["timestamp"]))
+        pairs = []
+        for r in ordered:
+            features = self.update(r)
+            if features is not None:
+                pairs.append((r, features))
+        return pairs
+
+    def features_for(self, equipment: str) -> Optional[dict]:
+        st = self._state.get(equipment)
+        return self._features(st) if st else None
+
+    def _features(self, st: _EquipmentState) -> dict:
+        cur = st.current
+        out = {
+            f"avg_{name}": st.hourly_mean(i, cur) for i, name in enumerate(RAW_METRICS)
+        }
+        temp, emis = out["avg_temperature"], out["avg_emissions"]
+
+        def roll(i: int, w: int, current: Optional[float]) -> Optional[float]:
+            total, n = st.prev.get((i, w), (0.0, 0))
+            if current is not None:
+                total += current
+                n += 1
+            return total / n if n else None
+
+        def trend(i: int, current: Optional[float]) -> Optional[float]:
+            past = st.hourly_mean(i, cur - _TREND_HOURS)
+            return current - past if current is not None and past is not None else None
+
+        out.update({
+            "temp_lag_1h": st.hourly_mean(_TEMP, cur - 1),
+            "temp_lag_2h": st.hourly_mean(_TEMP, cur - 2),
+            "emissions_lag_1h": st.hourly_mean(_EMIS, cur - 1),
+            "emissions_lag_2h": st.hourly_mean(_EMIS, cur - 2),
+            "temp_roll_3h": roll(_TEMP, 3, temp),
+            "temp_roll_6h": roll(_TEMP, 6, temp),
+            "emissions_roll_3h": roll(_EMIS, 3, emis),
+            "temp_trend_3h": trend(_TEMP, temp),
+            "emissions_trend_3h": trend(_EMIS, emis),
+        })
+        if self.missing_value is not None:
+            out = {k: self.missing_value if v is None else v for k, v in out.items()}
+        return out
@@ -8,23 +8,30 @@ from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 import joblib
+import pandas as pd
+from cement_operations_optimization.ml_train_deploy.streaming_features import (
+    FEATURE_COLS, RAW_METRICS, StreamingFeatureEngine,
+)
+from cement_operations_optimization.ml_train_deploy.compiled_scorer import (
+    COMPILED_MODEL_FILENAME, CompiledScorer, export_compiled,
+)
 
 # CONFIG
 PROJECT = os.getenv("GCP_PROJECT", "cement-operations-optimization")
 BQ_DATASET = os.getenv("BQ_DATASET", "plant")
 BQ_TABLE = os.getenv("BQ_FEATURES_TABLE", "cement_features_enriched")
+BQ_RAW_TABLE = os.getenv("BQ_RAW_TABLE", "cement_raw")
+# "replay": features from cement_raw through the streaming feature engine, the
+# same code that computes them at serving time; "enriched": BQ_FEATURES_TABLE
+TRAINING_SOURCE = os.getenv("TRAINING_SOURCE", "replay")
+TRAINING_DAYS = int(os.getenv("TRAINING_DAYS", "30"))
 GCS_BUCKET = os.getenv("GCS_BUCKET", "cement-ops-models")
 LOCATION = os.getenv("VERTEX_LOCATION", "asia-south1")
 
 MODEL_JOBLIB_PATH = "models/model.joblib"
+# kept outside models/ so the Vertex sklearn container only sees model.joblib
+MODEL_COMPILED_PATH = f"compiled/{COMPILED_MODEL_FILENAME}"
 
-FEATURE_COLS = [
-    "avg_temperature", "avg_pressure", "avg_vibration", "avg_power", "avg_emissions",
-    "avg_fineness", "avg_residue",
-    "temp_lag_1h", "temp_lag_2h", "emissions_lag_1h", "emissions_lag_2h",
-    "temp_roll_3h", "temp_roll_6h", "emissions_roll_3h",
-    "temp_trend_3h", "emissions_trend_3h"
-]
 LABEL_COL = "anomaly_label"
 
 def load_from_bigquery():
@@ -36,6 +43,25 @@ def load_from_bigquery():
     """
     return client.query(sql).to_dataframe()
 
+def load_replayed_features():
+    """
+    Replay cement_raw through StreamingFeatureEngine, so every training row
+    carries the features serving computes for that reading (running means of
+    the partial hour included), labelled with the reading's anomaly flag.
+    """
+    client = bigquery.Client(project=PROJECT)
+    sql = f"""
+    SELECT timestamp, equipment, {', '.join(RAW_METRICS)}, anomaly
+    FROM `{PROJECT}.{BQ_DATASET}.{BQ_RAW_TABLE}`
+    WHERE timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {TRAINING_DAYS} DAY)
+      AND anomaly IS NOT NULL
+    ORDER BY timestamp
+    """
+    records = client.query(sql).to_dataframe().to_dict(orient="records")
+    pairs = StreamingFeatureEngine().replay(records)
+    rows = [{**{c: features[c] for c in FEATURE_COLS}, LABEL_COL: int(bool(r["anomaly"]))} for r, features in pairs]
+    return pd.DataFrame(rows, columns=FEATURE_COLS + [LABEL_COL])
+
 def upload_to_gcs(local_path, bucket_name, dest_path):
     storage_client = storage.Client(project=PROJECT)
     bucket = storage_client.bucket(bucket_name)
@@ -57,8 +83,8 @@ def build_pipeline():
 
 
 def main():
-    print("📥 Loading data from BigQuery…")
-    df = load_from_bigquery()
+    print(f"📥 Loading data from BigQuery ({TRAINING_SOURCE})…")
+    df = load_replayed_features() if TRAINING_SOURCE == "replay" else load_from_bigquery()
     print("Rows:", len(df))
 
     if df.empty:
@@ -93,10 +119,20 @@ def main():
     joblib.dump(model, local_joblib)
     joblib.dump(model, "cement_sklearn_model.pkl")
 
+    local_compiled = f"tmp/{COMPILED_MODEL_FILENAME}"
+    export_compiled(model, local_compiled, feature_order=FEATURE_COLS)
+    compiled_proba = CompiledScorer.load(local_compiled).predict_proba(X_test)
+    max_diff = float(abs(compiled_proba - model.predict_proba(X_test)[:, 1]).max())
+    print("Compiled scorer max |Δp|:", max_diff)
+    if max_diff > 1e-6:
+        raise ValueError(f"❌ Compiled scorer diverges from the pipeline (max |Δp| = {max_diff})")
+
     upload_to_gcs(local_joblib, GCS_BUCKET.replace("gs://", ""), MODEL_JOBLIB_PATH)
+    upload_to_gcs(local_compiled, GCS_BUCKET.replace("gs://", ""), MODEL_COMPILED_PATH)
 
     print("✅ Model saved (sklearn pipeline):")
     print(f"   - Joblib: gs://{GCS_BUCKET}/{MODEL_JOBLIB_PATH}")
+    print(f"   - Compiled scorer: gs://{GCS_BUCKET}/{MODEL_COMPILED_PATH}")
 
     print("\n📊 Model Information:")
     print(f"   Model type: {type(model)}")
@@ -0,0 +1,74 @@
+from typing import List, Optional, Sequence
+
+TREND_SERIES = ["avg_temperature", "avg_emissions", "anomaly_prob"]
+
+
+def lttb_indices(values: Sequence[Optional[float]], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    the visual shape of the series (x is the row position). Missing values
+    count as 0 for the triangle area but can still be selected.
+    """
+    n = len(values)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    ys = [float(v) if v is not None else 0.0 for v in values]
+    every = (n - 2) / (threshold - 2)
+    picked = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third triangle vertex
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = (start + end - 1) / 2.0
+        avg_y = sum(ys[start:end]) / (end - start)
+
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        ax, ay = a, ys[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - j) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+def _peak_anomalies(rows: List[dict], anomalies: List[int], budget: int) -> List[int]:
+    """At most budget anomaly rows: split them, in order, into budget buckets and keep each bucket's peak anomaly_prob."""
+    if len(anomalies) <= budget:
+        return anomalies
+    if budget <= 0:
+        return []
+    picked = []
+    for b in range(budget):
+        chunk = anomalies[b * len(anomalies) // budget:(b + 1) * len(anomalies) // budget]
+        picked.append(max(chunk, key=lambda i: rows[i].get("anomaly_prob") or 0.0))
+    return picked
+
+
+def downsample_rows(rows: List[dict], max_points: int, series: Sequence[str] = TREND_SERIES) -> List[dict]:
+    """
+    Reduce rows to at most max_points while keeping each series' shape.
+    Anomaly rows count against the budget: all of them are kept while they
+    fit in half of it, otherwise the peak anomaly_prob of each bucket of
+    anomalies. The rest is split across series with LTTB. Row order is
+    preserved.
+    """
+    if len(rows) <= max_points:
+        return rows
+
+    shape_min = 3 * len(series)
+    anomaly_budget = min(max_points // 2, max(max_points - shape_min, 0))
+    anomalies = [i for i, r in enumerate(rows) if r.get("is_anomaly")]
+    keep = set(_peak_anomalies(rows, anomalies, anomaly_budget))
+    per_series = max((max_points - len(keep)) // len(series), 3)
+    for name in series:
+        keep.update(lttb_indices([r.get(name) for r in rows], per_series))
+    return [rows[i] for i in sorted(keep)]
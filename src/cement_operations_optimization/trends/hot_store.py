@@ -0,0 +1,239 @@
+import os
+import math
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from cement_operations_optimization.ml_train_deploy.streaming_features import FEATURE_COLS, parse_timestamp
+
+HOT_TIER_HOURS = float(os.getenv("HOT_TIER_HOURS", "6"))
+HOT_TIER_MAX_ROWS = int(os.getenv("HOT_TIER_MAX_ROWS_PER_EQUIPMENT", "200000"))
+
+FLOAT_COLUMNS = [*FEATURE_COLS, "anomaly_prob"]
+HOT_COLUMNS = ["seq_id", "equipment", "prediction_time", *FEATURE_COLS, "is_anomaly", "anomaly_prob"]
+
+# (prediction_time in epoch µs, seq_id); NULL seq_ids are stored as -1 like the cursor does
+Key = Tuple[int, int]
+# cursor position as decode_cursor returns it
+Cursor = Tuple[datetime, int]
+
+
+def _to_us(ts) -> int:
+    return int(parse_timestamp(ts).timestamp() * 1_000_000)
+
+
+def _from_us(us: int) -> datetime:
+    return datetime.fromtimestamp(us / 1_000_000, tz=timezone.utc)
+
+
+class _Series:
+    """One equipment's rows as parallel column arrays, ordered by Key."""
+    __slots__ = ("times", "seqs", "anomaly", "values", "floor_us")
+
+    def __init__(self):
+        self.times = array("q")
+        self.seqs = array("q")
+        self.anomaly = array("b")
+        self.values = {c: array("d") for c in FLOAT_COLUMNS}
+        # rows before this were dropped by the row cap, so the series is incomplete there
+        self.floor_us = 0
+
+    def position(self, key: Key) -> int:
+        """Index of the first row whose key is greater than key."""
+        t, s = key
+        lo = bisect_left(self.times, t)
+        hi = bisect_right(self.times, t, lo)
+        return bisect_right(self.seqs, s, lo, hi)
+
+    def insert(self, key: Key, row: dict):
+        i = self.position(key)
+        if i and self.times[i - 1] == key[0] and self.seqs[i - 1] == key[1]:
+            return  # already have it (backfill and feed overlap)
+        self.times.insert(i, key[0])
+        self.seqs.insert(i, key[1])
+        self.anomaly.insert(i, int(row.get("is_anomaly") or 0))
+        for c, arr in self.values.items():
+            v = row.get(c)
+            arr.insert(i, float(v) if v is not None else math.nan)
+
+    def drop_before(self, cut: int):
+        if cut <= 0:
+            return
+        del self.times[:cut]
+        del self.seqs[:cut]
+        del self.anomaly[:cut]
+        for arr in self.values.values():
+            del arr[:cut]
+
+    def row(self, equipment: str, i: int, columns: Sequence[str]) -> dict:
+        out = {}
+        for c in columns:
+            if c == "seq_id":
+                out[c] = self.seqs[i] if self.seqs[i] >= 0 else None
+            elif c == "equipment":
+                out[c] = equipment
+            elif c == "prediction_time":
+                out[c] = _from_us(self.times[i])
+            elif c == "is_anomaly":
+                out[c] = self.anomaly[i]
+            else:
+                v = self.values[c][i]
+                out[c] = None if math.isnan(v) else v
+        return out
+
+
+class HotStore:
+    """
+    The last `hours` of cement_predictions, per equipment, in memory.
+
+    Rows arrive from the prediction feed (and a BigQuery backfill on
+    startup) in any order and are kept sorted by (prediction_time, seq_id);
+    duplicates are ignored. Older rows are evicted as new ones arrive, and
+    each equipment is capped at max_rows. covers() tells whether a range
+    can be answered from memory without missing rows; that needs this
+    instance's own feed subscription to be delivering, so nothing is
+    served from memory before it is started or after it stopped.
+    """
+
+    def __init__(self, hours: float = HOT_TIER_HOURS, max_rows: int = HOT_TIER_MAX_ROWS):
+        self.hours = hours
+        self.max_rows = max_rows
+        self.ready = False
+        self._following: Callable[[], bool] = lambda: False
+        self._series: Dict[str, _Series] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[dict], following: Callable[[], bool]):
+        """
+        Backfill with rows of the last `hours` hours, then serve from memory
+        whenever following() says the feed keeping it current is running.
+        """
+        self._following = following
+        self.add_rows(rows)
+        # the window start only moves forward, and the backfill query's own
+        # cutoff was earlier than any later _cutoff_us(), so nothing is missing
+        self.ready = True
+
+    def add_rows(self, rows: Iterable[dict]):
+        with self._lock:
+            touched = set()
+            for row in rows:
+                # keyed like BigQuery pages: rows without a prediction_time
+                # (older pubsub_infer rows) match no time range or cursor
+                ts = row.get("prediction_time")
+                equipment = row.get("equipment")
+                if ts is None or equipment is None:
+                    continue
+                seq = row.get("seq_id")
+                series = self._series.setdefault(equipment, _Series())
+                series.insert((_to_us(ts), int(seq) if seq is not None else -1), row)
+                touched.add(equipment)
+            self._evict(touched)
+
+    def covers(self, start: datetime, equipment: Optional[Iterable[str]] = None) -> bool:
+        """True when every row at or after start (for these equipment) is in memory."""
+        if not self.live():
+            return False
+        start_us = _to_us(start)
+        with self._lock:
+            if start_us < self._cutoff_us():
+                return False
+            names = self._series.keys() if equipment is None else equipment
+            return all(start_us >= self._series[n].floor_us for n in names if n in self._series)
+
+    def live(self) -> bool:
+        return self.ready and self._following()
+
+    def equipment(self) -> List[str]:
+        with self._lock:
+            return list(self._series)
+
+    def rows(
+        self,
+        equipment: str,
+        columns: Sequence[str] = HOT_COLUMNS,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after: Optional[Cursor] = None,
+        before: Optional[Cursor] = None,
+        newest_first: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Rows of one equipment with start <= prediction_time < end and a key
+        strictly after / before the given cursors, in key order (or newest
+        first), at most limit of them.
+        """
+        with self._lock:
+            series = self._series.get(equipment)
+            if series is None:
+                return []
+            lo = bisect_left(series.times, _to_us(start)) if start is not None else 0
+            hi = bisect_left(series.times, _to_us(end)) if end is not None else len(series.times)
+            if after is not None:
+                lo = max(lo, series.position((_to_us(after[0]), after[1])))
+            if before is not None:
+                hi = min(hi, series.position((_to_us(before[0]), before[1] - 1)))
+            if hi <= lo:
+                return []
+            idx = range(hi - 1, lo - 1, -1) if newest_first else range(lo, hi)
+            if limit is not None:
+                idx = idx[:limit]
+            return [series.row(equipment, i, columns) for i in idx]
+
+    def latest(
+        self,
+        columns: Sequence[str],
+        limit: int,
+        equipment: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        before: Optional[Cursor] = None,
+    ) -> Optional[List[dict]]:
+        """
+        A newest-first /predictions page, or None when memory cannot answer
+        it exactly (a column it does not keep, or rows older than the window).
+        """
+        if not self.live() or any(c not in HOT_COLUMNS for c in columns):
+            return None
+        names = [equipment] if equipment else self.equipment()
+        rows = []
+        for name in names:
+            rows += self.rows(name, columns, start=start, end=end, before=before, newest_first=True, limit=limit)
+        rows.sort(key=lambda r: (r["prediction_time"], r["seq_id"] if r["seq_id"] is not None else -1), reverse=True)
+        rows = rows[:limit]
+        # complete if memory holds the whole range, or a full page lies inside it
+        if start is not None and self.covers(start, names):
+            return rows
+        if len(rows) == limit and self.covers(rows[-1]["prediction_time"], names):
+            return rows
+        return None
+
+    def _cutoff_us(self) -> int:
+        return int((time.time() - self.hours * 3600) * 1_000_000)
+
+    def _evict(self, names: Iterable[str]):
+        cutoff = self._cutoff_us()
+        for name in names:
+            series = self._series[name]
+            series.drop_before(bisect_left(series.times, cutoff))
+            overflow = len(series.times) - self.max_rows
+            if overflow > 0:
+                series.floor_us = series.times[overflow - 1] + 1
+                series.drop_before(overflow)
+
+
+def backfill_query(table: str) -> str:
+    """Rows for HotStore.load; @since is the start of the hot window."""
+    return f"""
+        SELECT {", ".join(HOT_COLUMNS)}
+        FROM `{table}`
+        WHERE prediction_time >= @since
+        ORDER BY equipment, prediction_time, seq_id
+    """
+
+
+hot_store = HotStore()
@@ -1,40 +1,206 @@
 # routes/trends.py
 import os
-from fastapi import APIRouter, Query
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import Dict, List, Optional
 from google.cloud import bigquery
 
+from cement_operations_optimization.trends.downsample import downsample_rows
+from cement_operations_optimization.trends.hot_store import HOT_TIER_HOURS, backfill_query, hot_store
+from cement_operations_optimization.utils.bq_executor import QueryTimeoutError, bq_executor
+from cement_operations_optimization.utils.cursor import AFTER_CURSOR_SQL, decode_cursor, row_cursor
+from cement_operations_optimization.utils.prediction_feed import feed_subscriber
+from cement_operations_optimization.utils.streaming import (
+    JSON, batches_from_rows, negotiate_format, prefetch, streaming_response,
+)
+
 router = APIRouter(tags=["Trends"])
-bq_client = bigquery.Client()
 
 PROJECT_ID = os.getenv("GCP_PROJECT", "cement-operations-optimization")
 BQ_DATASET = "plant"
 PREDICTIONS_TABLE = "cement_predictions"
+TRENDS_MAX_POINTS_LIMIT = int(os.getenv("TRENDS_MAX_POINTS_LIMIT", "5000"))
+TREND_FIELDS = ["seq_id", "prediction_time", "avg_temperature", "avg_emissions", "is_anomaly", "anomaly_prob"]
+TREND_COLUMNS = ", ".join(TREND_FIELDS)
 
-@router.get("/trends")
-def get_trends(
-    equipment: str = Query(..., description="Equipment name"),
-    hours: int = Query(2, description="Past hours to fetch")
+# router startup handlers can run twice (FastAPI >= 0.112 also runs them
+# through the router's merged lifespan); backfill and subscribe only once
+_hot_store_started = False
+
+@router.on_event("startup")
+async def start_hot_store():
+    """
+    Backfill the hot tier from BigQuery, then keep it current from this
+    instance's prediction feed subscription; memory only answers while
+    that subscription is being followed.
+    """
+    global _hot_store_started
+    if _hot_store_started:
+        return
+    _hot_store_started = True
+    if not feed_subscriber.enabled:
+        return
+    try:
+        since = datetime.now(timezone.utc) - timedelta(hours=HOT_TIER_HOURS)
+        rows = await bq_executor.query(
+            backfill_query(f"{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}"),
+            [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)],
+            label="hot_backfill", timeout=120,
+        )
+        hot_store.load(rows, following=lambda: feed_subscriber.following)
+        feed_subscriber.add_handler(lambda rows, publish_time: hot_store.add_rows(rows))
+        print(f"Trends hot tier backfilled with {len(rows)} rows")
+    except Exception as e:
+        print("Trends hot tier disabled, serving from BigQuery:", e)
+
+def _window_start(hours: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
+@router.get("/trends/batch")
+async def get_trends_batch(
+    response: Response,
+    equipment: Optional[List[str]] = Query(None, description="Equipment names (repeat the parameter); all when omitted"),
+    hours: int = Query(2, description="Past hours to fetch"),
+    max_points: Optional[int] = Query(
+        None, ge=10, le=TRENDS_MAX_POINTS_LIMIT,
+        description="Downsample each equipment to at most this many points (anomaly peaks are kept)",
+    ),
 ):
+    """
+    Trend windows for several equipment, grouped per equipment: from the
+    hot tier when it covers the window, else from a single BigQuery job.
+    """
+    start = _window_start(hours)
+    if hot_store.covers(start, equipment):
+        response.headers["X-Data-Source"] = "memory"
+        grouped = {
+            name: hot_store.rows(name, TREND_FIELDS, start=start)
+            for name in (equipment or hot_store.equipment())
+        }
+        return _batch_result(hours, grouped, max_points)
+
+    response.headers["X-Data-Source"] = "bigquery"
+    params = [bigquery.ScalarQueryParameter("hours", "INT64", hours)]
+    equipment_filter = ""
+    if equipment:
+        equipment_filter = "AND equipment IN UNNEST(@equipment)"
+        params.append(bigquery.ArrayQueryParameter("equipment", "STRING", equipment))
+
     query = f"""
-        SELECT
-          seq_id,
-          prediction_time,
-          avg_temperature,
-          avg_emissions,
-          is_anomaly,
-          anomaly_prob
+        SELECT equipment, {TREND_COLUMNS}
         FROM `{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}`
-        WHERE equipment = @equipment
-          AND prediction_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @hours HOUR)
-        ORDER BY prediction_time ASC
+        WHERE prediction_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @hours HOUR)
+          {equipment_filter}
+        ORDER BY equipment, prediction_time ASC, seq_id ASC
     """
+    try:
+        rows = await bq_executor.query(query, params, label="trends_batch")
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
-    job = bq_client.query(query, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("equipment", "STRING", equipment),
-            bigquery.ScalarQueryParameter("hours", "INT64", hours),
+    grouped: Dict[str, List[dict]] = {name: [] for name in equipment or []}
+    for r in rows:
+        grouped.setdefault(r.pop("equipment"), []).append(r)
+    return _batch_result(hours, grouped, max_points)
+
+def _batch_result(hours: int, grouped: Dict[str, List[dict]], max_points: Optional[int]) -> dict:
+    result = {}
+    for name, series in grouped.items():
+        data = downsample_rows(series, max_points) if max_points is not None else series
+        result[name] = {
+            "data": data,
+            "total_points": len(series),
+            "downsampled": len(data) < len(series),
+            "next_cursor": row_cursor(series[-1]) if series else None,
+        }
+    return {"hours": hours, "equipment": result}
+
+@router.get("/trends")
+async def get_trends(
+    request: Request,
+    response: Response,
+    equipment: str = Query(..., description="Equipment name"),
+    hours: int = Query(2, description="Past hours to fetch"),
+    max_points: Optional[int] = Query(
+        None, ge=10, le=TRENDS_MAX_POINTS_LIMIT,
+        description="Downsample to at most this many points (anomaly peaks are kept)",
+    ),
+    since: Optional[str] = Query(None, description="next_cursor of a previous call; only newer rows are returned"),
+    fmt: Optional[str] = Query(None, alias="format", description="json, ndjson or arrow (default: from Accept)"),
+):
+    """
+    One equipment's trend window, from the hot tier when it covers the
+    window, else from BigQuery. NDJSON and Arrow from BigQuery are streamed
+    page by page. Streamed responses end with their next_cursor (see
+    utils/streaming.py); when it is known up front it is also sent in
+    X-Next-Cursor.
+    """
+    fmt = negotiate_format(request, fmt)
+    cursor = None
+    if since:
+        try:
+            cursor = decode_cursor(since)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    start = _window_start(hours)
+    if hot_store.covers(start, [equipment]):
+        source = "memory"
+        rows = hot_store.rows(equipment, TREND_FIELDS, start=start, after=cursor)
+    else:
+        source = "bigquery"
+        query, params = _trends_query(cursor), _trends_params(equipment, hours, cursor)
+        try:
+            if fmt != JSON and max_points is None:
+                batches = await prefetch(bq_executor.stream(query, params, label="trends"))
+                return streaming_response(
+                    fmt, batches, headers={"X-Data-Source": source},
+                    next_cursor=lambda last, count: row_cursor(last) if last else since,
+                )
+            rows = await bq_executor.query(query, params, label="trends")
+        except QueryTimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+
+    total = len(rows)
+    next_cursor = row_cursor(rows[-1]) if rows else since
+    if max_points is not None:
+        rows = downsample_rows(rows, max_points)
+    if fmt != JSON:
+        headers = {"X-Total-Points": str(total), "X-Data-Source": source}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return streaming_response(fmt, batches_from_rows(rows), headers=headers, next_cursor=lambda last, count: next_cursor)
+    response.headers["X-Data-Source"] = source
+    return {
+        "equipment": equipment,
+        "data": rows,
+        "total_points": total,
+        "downsampled": len(rows) < total,
+        "next_cursor": next_cursor,
+    }
+
+def _trends_params(equipment: str, hours: int, cursor) -> list:
+    params = [
+        bigquery.ScalarQueryParameter("equipment", "STRING", equipment),
+        bigquery.ScalarQueryParameter("hours", "INT64", hours),
+    ]
+    if cursor:
+        params += [
+            bigquery.ScalarQueryParameter("cursor_time", "TIMESTAMP", cursor[0]),
+            bigquery.ScalarQueryParameter("cursor_seq", "INT64", cursor[1]),
         ]
-    ))
+    return params
 
-    rows = list(job.result())
-    return {"equipment": equipment, "data": [dict(r) for r in rows]}
+def _trends_query(cursor) -> str:
+    after_cursor = ""
+    if cursor:
+        # the time predicate lets BigQuery prune to the newest partitions only
+        after_cursor = f"AND {AFTER_CURSOR_SQL}"
+    return f"""
+        SELECT {TREND_COLUMNS}
+        FROM `{PROJECT_ID}.{BQ_DATASET}.{PREDICTIONS_TABLE}`
+        WHERE equipment = @equipment
+          AND prediction_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @hours HOUR)
+          {after_cursor}
+        ORDER BY prediction_time ASC, seq_id ASC
+    """
@@ -0,0 +1,110 @@
+import os
+import time
+import atexit
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from cement_operations_optimization.utils.shutdown import close_on_sigterm
+
+ALERT_WINDOW_SECONDS = float(os.getenv("ALERT_WINDOW_SECONDS", "60"))
+ALERT_FLUSH_INTERVAL_SECONDS = float(os.getenv("ALERT_FLUSH_INTERVAL_SECONDS", "5"))
+
+
+class _Window:
+    __slots__ = ("opened_at", "first", "last", "peak_prob", "count")
+
+    def __init__(self, alert: dict, prob: float):
+        self.opened_at = time.monotonic()
+        self.first = alert
+        self.last = alert
+        self.peak_prob = prob
+        self.count = 1
+
+
+class AlertCoalescer:
+    """
+    Collapses bursts of alerts before they reach cement-alerts.
+
+    Alerts are grouped per (equipment, anomaly_type). The first alert of a
+    window is published straight away; the rest only update the window's
+    last alert, peak probability and count. When the window (window_seconds)
+    ends, one summary message is published if anything was suppressed.
+    Expired windows are checked every flush_interval_seconds. Open windows
+    are summarised at exit and on SIGTERM.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[dict], None],
+        window_seconds: float = ALERT_WINDOW_SECONDS,
+        flush_interval_seconds: float = ALERT_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.publish = publish
+        self.window_seconds = window_seconds
+        self.flush_interval_seconds = flush_interval_seconds
+        self.received = 0
+        self.published = 0
+
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        # reentrant: the SIGTERM handler may flush while the main thread holds it
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="alert-coalescer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+        close_on_sigterm(self)
+
+    def add(self, alert: dict, anomaly_type: Optional[str] = None, prob: Optional[float] = None):
+        """Offer one alert; it is published now or folded into its open window."""
+        key = (alert.get("equipment"), anomaly_type or alert.get("anomaly_type") or "model")
+        prob = float(prob if prob is not None else alert.get("anomaly_prob", alert.get("prob", 0.0)) or 0.0)
+        with self._lock:
+            self.received += 1
+            win = self._windows.get(key)
+            if win is not None:
+                win.last = alert
+                win.count += 1
+                if prob > win.peak_prob:
+                    win.peak_prob = prob
+                return
+            self._windows[key] = _Window(alert, prob)
+        self._publish(alert)
+
+    def flush(self, force: bool = False):
+        """Close expired windows (all windows if force) and publish their summaries."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                k for k, w in self._windows.items()
+                if force or now - w.opened_at >= self.window_seconds
+            ]
+            closed = [(k, self._windows.pop(k)) for k in expired]
+        for (equipment, anomaly_type), win in closed:
+            if win.count > 1:
+                self._publish({
+                    "type": "alert_summary",
+                    "equipment": equipment,
+                    "anomaly_type": anomaly_type,
+                    "count": win.count,
+                    "peak_prob": win.peak_prob,
+                    "window_seconds": self.window_seconds,
+                    "first": win.first,
+                    "last": win.last,
+                })
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.flush(force=True)
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def _publish(self, message: dict):
+        try:
+            self.publish(message)
+            self.published += 1
+        except Exception as e:
+            print("Alert publish failed:", e)
@@ -1,11 +1,12 @@
 import os
 import json
 import asyncio
-from typing import Any
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import APIRouter, Depends, WebSocket
+from cement_operations_optimization.utils.auth import authenticate
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1.subscriber.message import Message
-from .realtime_state import connections
+from .realtime_state import alerts_broadcaster
 
 router = APIRouter(tags=["Alerts"])
 
@@ -19,21 +20,12 @@ subscription_path = subscriber_client.subscription_path(PROJECT_ID, ALERTS_SUBSC
 
 # background task handle
 _bg_task = None
+# the app's event loop; Pub/Sub callbacks run on their own threads
+_loop: Optional[asyncio.AbstractEventLoop] = None
 
 async def broadcast(message: dict):
-    """Send alert to all connected websockets"""
-    dead = []
-    text = json.dumps(message)
-    for ws in list(connections):
-        try:
-            await ws.send_text(text)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        try:
-            connections.remove(ws)
-        except KeyError:
-            pass
+    """Queue an alert for all connected websockets"""
+    alerts_broadcaster.broadcast(message)
 
 def _pubsub_callback(message: Message) -> None:
     """Synchronous callback called in a separate thread by subscriber. Use create_task to schedule."""
@@ -44,9 +36,8 @@ def _pubsub_callback(message: Message) -> None:
                 payload = json.loads(message.data.decode('utf-8'))
             except Exception:
                 payload = {"raw": message.data.decode('utf-8')}
-        # schedule broadcast in the main loop
-        loop = asyncio.get_event_loop()
-        loop.call_soon_threadsafe(asyncio.create_task, broadcast(payload))
+        # hand over to the main loop; the broadcaster only enqueues, so this never waits on clients
+        _loop.call_soon_threadsafe(alerts_broadcaster.broadcast, payload)
         message.ack()
     except Exception as e:
         print("Error in pubsub callback:", e)
@@ -68,7 +59,8 @@ async def _start_pubsub_listener():
 
 @router.on_event("startup")
 async def startup_event():
-    global _bg_task
+    global _bg_task, _loop
+    _loop = asyncio.get_running_loop()
     if _bg_task is None:
         # start background task to attach subscriber; run as background task
         _bg_task = asyncio.create_task(_start_pubsub_listener())
@@ -79,22 +71,13 @@ async def shutdown_event():
     if _bg_task:
         _bg_task.cancel()
         _bg_task = None
+    await alerts_broadcaster.close()
 
 @router.websocket("/ws/alerts")
-async def websocket_alerts(ws: WebSocket):
+async def websocket_alerts(ws: WebSocket, user: Optional[str] = Depends(authenticate)):
     await ws.accept()
-    connections.add(ws)
-    try:
-        # send a welcome / status message
-        await ws.send_text(json.dumps({"type": "hello", "msg": "connected to alerts websocket"}))
-        # keep connection alive until disconnect
-        while True:
-            # optional: wait for ping from client or sleep
-            await asyncio.sleep(60)
-    except WebSocketDisconnect:
-        pass
-    finally:
-        try:
-            connections.remove(ws)
-        except Exception:
-            pass
+    alerts_broadcaster.register(ws)
+    # send a welcome / status message
+    alerts_broadcaster.send(ws, {"type": "hello", "msg": "connected to alerts websocket"})
+    # keep connection alive until the client disconnects or falls too far behind
+    await alerts_broadcaster.serve(ws)
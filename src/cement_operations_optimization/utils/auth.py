@@ -1,7 +1,12 @@
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, WebSocketException, status
+from fastapi.requests import HTTPConnection
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import threading
+import time
 import os as process
 from dotenv import load_dotenv
 
@@ -10,10 +15,19 @@ load_dotenv()
 SECRET_KEY = process.getenv("SECRET_KEY")
 if not SECRET_KEY:
     raise RuntimeError("SECRET_KEY environment variable is not set. Please check your .env file.")
+# comma-separated keys still accepted for verification while SECRET_KEY is rotated
+PREVIOUS_SECRET_KEYS = [k for k in process.getenv("PREVIOUS_SECRET_KEYS", "").split(",") if k]
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+AUTH_TOKEN_CACHE_SIZE = int(process.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# upper bound for caching tokens that carry no exp claim
+AUTH_TOKEN_CACHE_MAX_SECONDS = float(process.getenv("AUTH_TOKEN_CACHE_MAX_SECONDS", "300"))
+# reject /ws/* handshakes without a token (tokens that are sent are always verified)
+WS_AUTH_REQUIRED = process.getenv("WS_AUTH_REQUIRED", "0") == "1"
+
+# current key first: it matches almost every token, so rotation costs no extra HMAC
+VERIFY_KEYS = [SECRET_KEY, *PREVIOUS_SECRET_KEYS]
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -21,17 +35,97 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+
+class TokenCache:
+    """
+    LRU of verified JWT claims keyed by the token's SHA-256 digest (the raw
+    token is never kept). An entry is served until the token's exp, so a
+    token is decoded and HMAC-verified once, not on every request.
+    """
+
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            claims, valid_until = entry
+            if time.time() >= valid_until:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def put(self, digest: bytes, claims: dict):
+        exp = claims.get("exp")
+        now = time.time()
+        valid_until = float(exp) if exp is not None else now + AUTH_TOKEN_CACHE_MAX_SECONDS
+        with self._lock:
+            self._entries[digest] = (claims, valid_until)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verified claims of a token, from the cache when possible. Raises
+    JWTError for bad signatures, expired tokens and tokens without sub.
+    One decode tries every key in VERIFY_KEYS.
+    """
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = token_cache.get(digest)
+    if claims is None:
+        claims = jwt.decode(token, VERIFY_KEYS, algorithms=[ALGORITHM])
+        if claims.get("sub") is None:
+            raise JWTError("Token has no subject")
+        token_cache.put(digest, claims)
+    return claims
+
+
+def _connection_token(conn: HTTPConnection) -> Optional[str]:
+    """Bearer token from the Authorization header, or ?token= (browsers cannot set headers on websockets)."""
+    scheme, _, credentials = conn.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    return conn.query_params.get("token")
+
+
+def authenticate(conn: HTTPConnection) -> Optional[str]:
+    """
+    The one auth dependency for HTTP routes and websocket handshakes;
+    returns the user's email. Failures are a 401 over HTTP and a 1008
+    close on websockets. Websockets without a token are let through (as
+    None) unless WS_AUTH_REQUIRED is set.
+    """
+    is_ws = conn.scope["type"] == "websocket"
+    token = _connection_token(conn)
+    if token is None and is_ws and not WS_AUTH_REQUIRED:
+        return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        return email
+        if token is None:
+            raise JWTError("Missing token")
+        return decode_token(token)["sub"]
     except JWTError:
-        raise credentials_exception
+        if is_ws:
+            raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+def verify_token(user: Optional[str] = Depends(authenticate)) -> Optional[str]:
+    """Kept for existing imports; the same check as authenticate."""
+    return user
@@ -0,0 +1,173 @@
+import json
+import queue
+from collections import deque
+import threading
+import time
+from typing import Callable, List, Optional
+
+# A stage receives the records of one batch and returns the records to hand
+# to the next stage (it may drop or replace them).
+Stage = Callable[[List[dict]], List[dict]]
+
+
+def _drain(q: "queue.Queue", max_messages: int, timeout: float) -> list:
+    """Block up to timeout for the first item, then take whatever is ready."""
+    try:
+        items = [q.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + timeout
+    while len(items) < max_messages:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(q.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+
+class QueuedMessage:
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class QueueSource:
+    """In-process stand-in for a Pub/Sub subscription (local runs, benchmarks)."""
+
+    def __init__(self, maxsize: int = 0):
+        self._queue: "queue.Queue[QueuedMessage]" = queue.Queue(maxsize)
+        # nacked messages, redelivered before new ones; unbounded so nack()
+        # never blocks on a queue the publisher keeps full
+        self._redeliver: deque = deque()
+        self.acked = 0
+        self.nacked = 0
+
+    def publish(self, data: bytes):
+        self._queue.put(QueuedMessage(data))
+
+    def pull(self, max_messages: int, timeout: float) -> list:
+        items = []
+        while self._redeliver and len(items) < max_messages:
+            items.append(self._redeliver.popleft())
+        if not items:
+            return _drain(self._queue, max_messages, timeout)
+        while len(items) < max_messages:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def ack(self, messages: list):
+        self.acked += len(messages)
+
+    def nack(self, messages: list):
+        self.nacked += len(messages)
+        self._redeliver.extend(messages)
+
+    def close(self):
+        pass
+
+
+class PubSubSource:
+    """
+    Streaming pull from a Pub/Sub subscription into a local queue.
+    Honors PUBSUB_EMULATOR_HOST like every other google-cloud-pubsub client.
+    Acks are handed to the subscriber's dispatcher, which sends them in bulk.
+    """
+
+    def __init__(self, subscription_path: str, max_outstanding: int = 2000, subscriber=None):
+        from google.cloud import pubsub_v1
+
+        self.subscription_path = subscription_path
+        self.subscriber = subscriber or pubsub_v1.SubscriberClient()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._future = self.subscriber.subscribe(
+            subscription_path,
+            callback=self._queue.put,
+            flow_control=pubsub_v1.types.FlowControl(max_messages=max_outstanding),
+        )
+
+    def pull(self, max_messages: int, timeout: float) -> list:
+        return _drain(self._queue, max_messages, timeout)
+
+    def ack(self, messages: list):
+        for m in messages:
+            m.ack()
+
+    def nack(self, messages: list):
+        for m in messages:
+            m.nack()
+
+    def close(self):
+        self._future.cancel()
+        try:
+            self._future.result(timeout=10)
+        except Exception:
+            pass
+
+
+def decode_json(messages: list) -> List[dict]:
+    records = []
+    for m in messages:
+        try:
+            records.append(json.loads(m.data))
+        except Exception as e:
+            # poison message: log and drop so it is acked with the batch
+            print("Dropping undecodable message:", e)
+    return records
+
+
+class BatchConsumer:
+    """
+    Long-running worker: pulls up to batch_size messages, runs every stage
+    once over the whole batch and acks the batch together. If any stage
+    raises, the batch is nacked for redelivery.
+    """
+
+    def __init__(
+        self,
+        source,
+        stages: List[Stage],
+        batch_size: int = 500,
+        max_wait_seconds: float = 0.5,
+        decode: Callable[[list], List[dict]] = decode_json,
+    ):
+        self.source = source
+        self.stages = stages
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.decode = decode
+        self.processed = 0
+        self.failed_batches = 0
+
+    def run_once(self) -> int:
+        messages = self.source.pull(self.batch_size, self.max_wait_seconds)
+        if not messages:
+            return 0
+        try:
+            records = self.decode(messages)
+            for stage in self.stages:
+                if not records:
+                    break
+                records = stage(records)
+        except Exception as e:
+            print(f"Batch of {len(messages)} failed, nacking:", e)
+            self.failed_batches += 1
+            self.source.nack(messages)
+            return 0
+        self.source.ack(messages)
+        self.processed += len(messages)
+        return len(messages)
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        stop_event = stop_event or threading.Event()
+        try:
+            while not stop_event.is_set():
+                self.run_once()
+        finally:
+            self.source.close()
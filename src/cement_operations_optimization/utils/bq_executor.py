@@ -0,0 +1,213 @@
+import os
+import time
+import atexit
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Sequence
+
+from google.cloud import bigquery
+
+from cement_operations_optimization.utils.metrics import Counter, Histogram
+
+PROJECT_ID = os.getenv("GCP_PROJECT", "cement-operations-optimization")
+BQ_MAX_CONCURRENT_QUERIES = int(os.getenv("BQ_MAX_CONCURRENT_QUERIES", "8"))
+BQ_QUERY_TIMEOUT_SECONDS = float(os.getenv("BQ_QUERY_TIMEOUT_SECONDS", "30"))
+BQ_STREAM_PAGE_SIZE = int(os.getenv("BQ_STREAM_PAGE_SIZE", "10000"))
+# log queries slower than this (wall time); 0 disables slow-query logging
+BQ_SLOW_QUERY_SECONDS = float(os.getenv("BQ_SLOW_QUERY_SECONDS", "0"))
+
+_SECONDS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+_BYTES_BUCKETS = [10 ** p for p in range(4, 13)]  # 10 KB .. 1 TB
+_ROWS_BUCKETS = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+
+QUERIES = Counter("bq_queries_total", "BigQuery queries by endpoint and outcome (ok, error, timeout, abandoned).", ["endpoint", "outcome"])
+CACHE_HITS = Counter("bq_query_cache_hits_total", "BigQuery queries answered from the query cache.", ["endpoint"])
+BYTES_PROCESSED = Counter("bq_bytes_processed_total", "Bytes processed by BigQuery queries.", ["endpoint"])
+BYTES_BILLED = Counter("bq_bytes_billed_total", "Bytes billed for BigQuery queries.", ["endpoint"])
+SLOT_MILLIS = Counter("bq_slot_milliseconds_total", "Slot milliseconds used by BigQuery queries.", ["endpoint"])
+ROWS = Counter("bq_rows_total", "Rows returned by BigQuery queries.", ["endpoint"])
+WALL_SECONDS = Histogram("bq_query_wall_seconds", "Wall time of BigQuery queries, queueing included.", _SECONDS_BUCKETS, ["endpoint"])
+QUEUE_SECONDS = Histogram("bq_query_queue_seconds", "Time waiting for an executor slot plus time pending in BigQuery.", _SECONDS_BUCKETS, ["endpoint"])
+BYTES_PER_QUERY = Histogram("bq_query_bytes_processed", "Bytes processed per BigQuery query.", _BYTES_BUCKETS, ["endpoint"])
+ROWS_PER_QUERY = Histogram("bq_query_rows", "Rows returned per BigQuery query.", _ROWS_BUCKETS, ["endpoint"])
+
+
+class QueryTimeoutError(TimeoutError):
+    pass
+
+
+class _Run:
+    """State shared between an awaiting request and the thread running its job."""
+    __slots__ = ("job", "abandoned", "queued_at", "started_at")
+
+    def __init__(self):
+        self.job = None
+        self.abandoned = threading.Event()
+        self.queued_at = time.monotonic()
+        self.started_at = None
+
+
+class BigQueryExecutor:
+    """
+    Runs BigQuery queries for the async routers on a dedicated, bounded
+    thread pool, so slow queries neither block the event loop nor use up
+    Starlette's shared thread pool.
+
+    Each query has a timeout (covering the wait for a pool slot). If it
+    expires, or the awaiting request is cancelled, the BigQuery job is
+    cancelled too. Every query is recorded under its label (the endpoint
+    name): wall and queue time, bytes processed and billed, slot ms, cache
+    hit and rows, as the bq_* metrics on /metrics. Queries slower than
+    BQ_SLOW_QUERY_SECONDS are logged.
+    """
+
+    def __init__(self, client=None, max_concurrency: int = BQ_MAX_CONCURRENT_QUERIES, timeout_seconds: float = BQ_QUERY_TIMEOUT_SECONDS):
+        self._client = client
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bq-query")
+        atexit.register(self.close)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = bigquery.Client(project=PROJECT_ID)
+        return self._client
+
+    async def query(
+        self,
+        sql: str,
+        params: Optional[Sequence] = None,
+        label: str = "default",
+        timeout: Optional[float] = None,
+    ) -> List[dict]:
+        """Run sql with query parameters and return its rows as dicts."""
+        timeout = timeout or self.timeout_seconds
+        run = _Run()
+        fut = asyncio.wrap_future(self._pool.submit(self._execute, run, sql, params, timeout))
+        try:
+            rows = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(run, label, timed_out=True)
+            raise QueryTimeoutError(f"{label} query exceeded {timeout:.1f}s")
+        except asyncio.CancelledError:
+            self._abandon(run, label)
+            raise
+        except Exception:
+            self._record(label, run, error=True)
+            raise
+        self._record(label, run, rows=len(rows))
+        return rows
+
+    async def stream(
+        self,
+        sql: str,
+        params: Optional[Sequence] = None,
+        label: str = "default",
+        timeout: Optional[float] = None,
+        page_size: int = BQ_STREAM_PAGE_SIZE,
+    ) -> AsyncIterator:
+        """
+        Run sql and yield its result as pyarrow RecordBatches, one page at a
+        time, so the caller never holds the whole result. The timeout covers
+        the query itself; each page is then fetched on the pool.
+        """
+        timeout = timeout or self.timeout_seconds
+        run = _Run()
+        fut = asyncio.wrap_future(self._pool.submit(self._execute, run, sql, params, timeout, page_size))
+        try:
+            batches = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(run, label, timed_out=True)
+            raise QueryTimeoutError(f"{label} query exceeded {timeout:.1f}s")
+        except asyncio.CancelledError:
+            self._abandon(run, label)
+            raise
+        except Exception:
+            self._record(label, run, error=True)
+            raise
+
+        loop = asyncio.get_running_loop()
+        rows, failed = 0, False
+        try:
+            while True:
+                batch = await loop.run_in_executor(self._pool, next, batches, None)
+                if batch is None:
+                    break
+                rows += batch.num_rows
+                yield batch
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # also reached when the client goes away mid-stream
+            self._record(label, run, rows=rows, error=failed)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _execute(self, run: _Run, sql: str, params, timeout: float, page_size: Optional[int] = None):
+        """Rows as dicts, or with page_size an iterator of pyarrow RecordBatches."""
+        run.started_at = time.monotonic()
+        if run.abandoned.is_set():
+            raise RuntimeError("query abandoned before it started")
+        job_config = bigquery.QueryJobConfig(query_parameters=list(params or []))
+        run.job = self.client.query(sql, job_config=job_config)
+        if run.abandoned.is_set():
+            self._cancel_job(run)
+            raise RuntimeError("query abandoned")
+        remaining = max(timeout - (run.started_at - run.queued_at), 0.1)
+        if page_size:
+            return iter(run.job.result(timeout=remaining, page_size=page_size).to_arrow_iterable())
+        return [dict(r) for r in run.job.result(timeout=remaining)]
+
+    def _abandon(self, run: _Run, label: str, timed_out: bool = False):
+        run.abandoned.set()
+        # jobs.cancel is an HTTP call; keep it off the event loop (and out of a full pool)
+        threading.Thread(target=self._cancel_job, args=(run,), daemon=True).start()
+        QUERIES.inc(endpoint=label, outcome="timeout" if timed_out else "abandoned")
+        WALL_SECONDS.observe(time.monotonic() - run.queued_at, endpoint=label)
+        print(f"BigQuery {label} query {'timed out' if timed_out else 'abandoned'}; cancelling job")
+
+    def _cancel_job(self, run: _Run):
+        job = run.job
+        if job is None or job.done(reload=False):
+            return
+        try:
+            job.cancel()
+        except Exception as e:
+            print("BigQuery job cancel failed:", e)
+
+    def _record(self, label: str, run: _Run, rows: int = 0, error: bool = False):
+        wall = time.monotonic() - run.queued_at
+        QUERIES.inc(endpoint=label, outcome="error" if error else "ok")
+        WALL_SECONDS.observe(wall, endpoint=label)
+        job = run.job
+        if error or job is None:
+            return
+
+        queued = (run.started_at or run.queued_at) - run.queued_at
+        if job.created and job.started:
+            queued += max((job.started - job.created).total_seconds(), 0.0)
+        processed = job.total_bytes_processed or 0
+        QUEUE_SECONDS.observe(queued, endpoint=label)
+        BYTES_PER_QUERY.observe(processed, endpoint=label)
+        ROWS_PER_QUERY.observe(rows, endpoint=label)
+        BYTES_PROCESSED.inc(processed, endpoint=label)
+        BYTES_BILLED.inc(job.total_bytes_billed or 0, endpoint=label)
+        SLOT_MILLIS.inc(job.slot_millis or 0, endpoint=label)
+        ROWS.inc(rows, endpoint=label)
+        if job.cache_hit:
+            CACHE_HITS.inc(endpoint=label)
+
+        if BQ_SLOW_QUERY_SECONDS and wall >= BQ_SLOW_QUERY_SECONDS:
+            print(
+                f"Slow BigQuery query [{label}] job={job.job_id} wall={wall:.2f}s queue={queued:.2f}s "
+                f"processed={processed}B billed={job.total_bytes_billed or 0}B slot_ms={job.slot_millis or 0} "
+                f"cache_hit={bool(job.cache_hit)} rows={rows}"
+            )
+
+
+# shared by the API routers
+bq_executor = BigQueryExecutor()
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import atexit
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cement_operations_optimization.utils.shutdown import close_on_sigterm
+
+# BigQuery streaming inserts accept up to 10 MB / ~500 rows per request
+# comfortably; stay below that by default.
+MAX_ROWS = int(os.getenv("BQ_BATCH_MAX_ROWS", "500"))
+MAX_BYTES = int(os.getenv("BQ_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+MAX_AGE_SECONDS = float(os.getenv("BQ_BATCH_MAX_AGE_SECONDS", "1.0"))
+
+# (row, errors) for every row BigQuery rejected
+FailedRows = List[Tuple[dict, list]]
+
+
+def _print_failed_rows(table: str, failed: FailedRows) -> None:
+    for row, errors in failed:
+        print(f"BigQuery insert error on {table}: {errors} row={row}")
+
+
+class InsertError(RuntimeError):
+    """Rows BigQuery rejected or never received."""
+
+    def __init__(self, table: str, failed: FailedRows):
+        super().__init__(f"{len(failed)} row(s) not written to {table}: {failed[0][1]}")
+        self.table = table
+        self.failed = failed
+
+
+class _TableBuffer:
+    __slots__ = ("rows", "nbytes", "first_ts")
+
+    def __init__(self):
+        self.rows: List[dict] = []
+        self.nbytes = 0
+        self.first_ts = 0.0
+
+
+class BatchingRowWriter:
+    """
+    Buffers rows per table and streams them to BigQuery with one
+    insert_rows_json call per batch instead of one per row.
+
+    A table is flushed when it reaches max_rows, max_bytes (approximate JSON
+    size) or when its oldest buffered row is older than max_age_seconds.
+    Rows rejected by BigQuery are reported one by one through on_errors.
+    With row_id, each row is sent with that stable insertId (random when it
+    returns None), so BigQuery drops the copy a redelivered message sends.
+    Everything still buffered is flushed at exit and on SIGTERM; per-event
+    handlers should use write_through() so nothing is left in the buffer
+    once their message is acked.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_rows: int = MAX_ROWS,
+        max_bytes: int = MAX_BYTES,
+        max_age_seconds: float = MAX_AGE_SECONDS,
+        on_errors: Optional[Callable[[str, FailedRows], None]] = None,
+        row_id: Optional[Callable[[dict], Optional[str]]] = None,
+    ):
+        self.client = client
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.on_errors = on_errors or _print_failed_rows
+        self.row_id = row_id
+
+        self._buffers: Dict[str, _TableBuffer] = {}
+        # reentrant: the SIGTERM handler may flush while the main thread holds it
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="bq-row-writer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+        close_on_sigterm(self)
+
+    def insert(self, table: str, row: dict) -> FailedRows:
+        """Buffer one row for table; flushes inline when the batch is full."""
+        return self.insert_many(table, [row])
+
+    def insert_many(self, table: str, rows: List[dict]) -> FailedRows:
+        """Buffer rows; returns the failures of any batch that was sent inline."""
+        if self._closed.is_set():
+            # after shutdown write straight through rather than dropping rows
+            return self._send(table, list(rows))
+
+        ready = []
+        with self._lock:
+            buf = self._buffers.setdefault(table, _TableBuffer())
+            for row in rows:
+                size = len(json.dumps(row, default=str))
+                if buf.rows and buf.nbytes + size > self.max_bytes:
+                    ready.append(buf.rows)
+                    buf = self._buffers[table] = _TableBuffer()
+                if not buf.rows:
+                    buf.first_ts = time.monotonic()
+                buf.rows.append(row)
+                buf.nbytes += size
+                if len(buf.rows) >= self.max_rows:
+                    ready.append(buf.rows)
+                    buf = self._buffers[table] = _TableBuffer()
+
+        failed: FailedRows = []
+        for batch in ready:
+            failed.extend(self._send(table, batch))
+        return failed
+
+    def write_through(self, table: str, rows: List[dict]) -> None:
+        """
+        Insert rows and flush the table before returning, so the caller can
+        ack its message. Raises InsertError if any row was not written.
+        """
+        failed = self.insert_many(table, rows)
+        failed.extend(self.flush(table))
+        if failed:
+            raise InsertError(str(table), failed)
+
+    def flush(self, table: Optional[str] = None) -> FailedRows:
+        """Flush one table (or all tables) now. Returns the rows that failed."""
+        with self._lock:
+            tables = [table] if table else list(self._buffers)
+            batches = []
+            for t in tables:
+                buf = self._buffers.pop(t, None)
+                if buf and buf.rows:
+                    batches.append((t, buf.rows))
+
+        failed: FailedRows = []
+        for t, rows in batches:
+            failed.extend(self._send(t, rows))
+        return failed
+
+    def close(self) -> None:
+        """Stop the background flusher and write out everything still buffered."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join(timeout=self.max_age_seconds + 1)
+        self.flush()
+
+    def _flush_loop(self) -> None:
+        interval = max(self.max_age_seconds / 2, 0.05)
+        while not self._closed.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                expired = [
+                    t for t, buf in self._buffers.items()
+                    if buf.rows and now - buf.first_ts >= self.max_age_seconds
+                ]
+            for t in expired:
+                self.flush(t)
+
+    def _send(self, table: str, rows: List[dict]) -> FailedRows:
+        if not rows:
+            return []
+        kwargs = {}
+        if self.row_id is not None:
+            kwargs["row_ids"] = [self.row_id(row) or str(uuid.uuid4()) for row in rows]
+        try:
+            errors = self.client.insert_rows_json(table, rows, **kwargs)
+        except Exception as e:
+            failed = [(row, [{"message": str(e)}]) for row in rows]
+        else:
+            failed = [(rows[err["index"]], err.get("errors", [])) for err in errors or []]
+        if failed:
+            try:
+                self.on_errors(table, failed)
+            except Exception as e:
+                print("BigQuery error handler failed:", e)
+        return failed
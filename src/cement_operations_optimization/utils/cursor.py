@@ -0,0 +1,37 @@
+import base64
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from cement_operations_optimization.ml_train_deploy.streaming_features import parse_timestamp
+
+# SQL predicates for "strictly after / before the cursor" on (prediction_time, seq_id).
+# NULL seq_ids sort as -1 so older rows written without one still page correctly.
+AFTER_CURSOR_SQL = (
+    "(prediction_time > @cursor_time"
+    " OR (prediction_time = @cursor_time AND IFNULL(seq_id, -1) > @cursor_seq))"
+)
+BEFORE_CURSOR_SQL = (
+    "(prediction_time < @cursor_time"
+    " OR (prediction_time = @cursor_time AND IFNULL(seq_id, -1) < @cursor_seq))"
+)
+
+
+def encode_cursor(prediction_time, seq_id: Optional[int]) -> str:
+    """Opaque, URL-safe cursor for the (prediction_time, seq_id) position of a row."""
+    ts = parse_timestamp(prediction_time).astimezone(timezone.utc).isoformat()
+    raw = f"{ts}|{seq_id if seq_id is not None else -1}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, seq = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|")
+        return parse_timestamp(ts), int(seq)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def row_cursor(row: dict) -> str:
+    return encode_cursor(row["prediction_time"], row.get("seq_id"))
@@ -0,0 +1,81 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+AUTH_BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(os.cpu_count() or 2, 4))))
+# hashes running or waiting; requests beyond this get an overload response
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", str(AUTH_HASH_WORKERS * 4)))
+AUTH_HASH_EXECUTOR = os.getenv("AUTH_HASH_EXECUTOR", "process")  # process | thread
+
+# hashes with a different cost are flagged by needs_update() and rehashed after login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=AUTH_BCRYPT_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HasherOverloadedError(RuntimeError):
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, size-limited executor (a spawn-based
+    process pool by default, so hashing is not serialised by the GIL).
+    At most max_pending calls may be running or queued; beyond that the
+    call fails fast with HasherOverloadedError.
+    """
+
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_HASH_MAX_PENDING, kind: str = AUTH_HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            else:
+                # spawn: the API process has background threads, which fork does not copy safely
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def needs_update(self, hashed: str) -> bool:
+        return pwd_context.needs_update(hashed)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        # only touched from the event loop thread, so a plain counter is enough
+        if self.pending >= self.max_pending:
+            raise HasherOverloadedError("Too many authentication requests in progress, retry shortly")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,139 @@
+import os
+import json
+import uuid
+from datetime import datetime
+from typing import Callable, List
+
+from google.cloud import pubsub_v1
+
+PROJECT_ID = os.getenv("GCP_PROJECT", "cement-operations-optimization")
+PREDICTIONS_TOPIC = os.getenv("PREDICTIONS_TOPIC")  # e.g. "cement-predictions"; unset disables the feed
+# each API instance follows the feed on its own subscription, named
+# <prefix>-<revision>-<random>; it needs pubsub.subscriptions.create/delete
+PREDICTIONS_SUBSCRIPTION_PREFIX = os.getenv("PREDICTIONS_SUBSCRIPTION_PREFIX", "cement-predictions-api")
+# Pub/Sub deletes subscriptions of instances that died without shutdown after this (minimum 1 day)
+PREDICTIONS_SUBSCRIPTION_TTL_SECONDS = int(os.getenv("PREDICTIONS_SUBSCRIPTION_TTL_SECONDS", str(24 * 3600)))
+FEED_MAX_ROWS_PER_MESSAGE = int(os.getenv("PREDICTIONS_FEED_MAX_ROWS", "500"))
+
+
+class PredictionFeed:
+    """
+    Republishes written prediction rows to PREDICTIONS_TOPIC, many rows per
+    message, so API instances can keep in-memory state without re-querying
+    BigQuery. A no-op when the topic is not configured.
+    """
+
+    def __init__(self, publisher, project_id: str, topic: str = PREDICTIONS_TOPIC):
+        self.publisher = publisher
+        self.topic_path = publisher.topic_path(project_id, topic) if topic else None
+
+    def publish(self, rows: List[dict]):
+        if not self.topic_path or not rows:
+            return
+        for i in range(0, len(rows), FEED_MAX_ROWS_PER_MESSAGE):
+            chunk = rows[i:i + FEED_MAX_ROWS_PER_MESSAGE]
+            self.publisher.publish(self.topic_path, json.dumps(chunk, default=str).encode("utf-8"))
+
+
+def rows_from_message(data: bytes) -> List[dict]:
+    """Feed messages carry a JSON list of rows (or a single row)."""
+    payload = json.loads(data)
+    return payload if isinstance(payload, list) else [payload]
+
+
+FeedHandler = Callable[[List[dict], datetime], None]
+
+
+class PredictionFeedSubscriber:
+    """
+    One streaming pull on the prediction feed per API process, fanned out
+    to every in-memory consumer (KPI state, trends hot tier).
+
+    Pub/Sub hands each message of a subscription to only one subscriber, so
+    instances sharing one would each see a fraction of the rows. Every
+    instance therefore creates its own subscription (create_subscription(),
+    before the consumers backfill) and deletes it in stop(). The feed is
+    enabled once that subscription exists. Handlers get (rows, publish_time)
+    and are registered before start(); messages wait in the subscription
+    until then, so none are lost during backfills.
+    """
+
+    def __init__(self, project_id: str = PROJECT_ID, topic: str = PREDICTIONS_TOPIC,
+                 prefix: str = PREDICTIONS_SUBSCRIPTION_PREFIX):
+        self.project_id = project_id
+        self.topic = topic
+        self.prefix = prefix
+        self.subscription = None
+        self.handlers: List[FeedHandler] = []
+        self._client = None
+        self._future = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.subscription is not None
+
+    def create_subscription(self):
+        """Create this instance's subscription on PREDICTIONS_TOPIC (a no-op without a topic)."""
+        if not self.topic or self.subscription is not None:
+            return
+        name = f"{self.prefix}-{os.getenv('K_REVISION', 'local')}-{uuid.uuid4().hex[:8]}"
+        try:
+            client = pubsub_v1.SubscriberClient()
+            client.create_subscription(request={
+                "name": client.subscription_path(self.project_id, name),
+                "topic": f"projects/{self.project_id}/topics/{self.topic}",
+                "expiration_policy": {"ttl": {"seconds": PREDICTIONS_SUBSCRIPTION_TTL_SECONDS}},
+                # only needed across startup; the minimum retention Pub/Sub allows
+                "message_retention_duration": {"seconds": 600},
+            })
+        except Exception as e:
+            print("Prediction feed disabled, could not create a subscription:", e)
+            return
+        self._client = client
+        self.subscription = name
+
+    @property
+    def following(self) -> bool:
+        """True while the streaming pull on this instance's subscription is running."""
+        return self._future is not None and not self._future.done()
+
+    def add_handler(self, handler: FeedHandler):
+        self.handlers.append(handler)
+
+    def start(self):
+        if not self.enabled or not self.handlers or self._future is not None:
+            return
+        self._future = self._client.subscribe(
+            self._client.subscription_path(self.project_id, self.subscription), callback=self._callback
+        )
+        print(f"Following prediction feed {self.subscription} for {len(self.handlers)} consumer(s)")
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        if self.subscription is not None:
+            try:
+                self._client.delete_subscription(
+                    request={"subscription": self._client.subscription_path(self.project_id, self.subscription)}
+                )
+            except Exception as e:
+                print(f"Could not delete prediction feed subscription {self.subscription}:", e)
+            self.subscription = None
+
+    def _callback(self, message):
+        try:
+            rows = rows_from_message(message.data)
+        except Exception as e:
+            print("Dropping undecodable prediction feed message:", e)
+            message.ack()
+            return
+        for handler in self.handlers:
+            try:
+                handler(rows, message.publish_time)
+            except Exception as e:
+                print("Error in prediction feed handler:", e)
+        message.ack()
+
+
+feed_subscriber = PredictionFeedSubscriber()
@@ -1,23 +1,12 @@
-from typing import Set
-from fastapi import WebSocket
 import asyncio
-import json
 
-#  this set is per Cloud Run instance.
-connections: Set[WebSocket] = set()
+from cement_operations_optimization.utils.ws_broadcaster import Broadcaster
+
+#  these clients are per Cloud Run instance.
+alerts_broadcaster = Broadcaster("alerts")
 
 async def broadcast(message: dict):
-    dead = []
-    for ws in list(connections):
-        try:
-            await ws.send_text(json.dumps(message))
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        try:
-            connections.remove(ws)
-        except Exception:
-            pass
+    alerts_broadcaster.broadcast(message)
 
 # Example: periodically send a test message to all clients (for debugging)
 async def test_sender():
@@ -0,0 +1,46 @@
+import os
+import signal
+import threading
+import weakref
+
+# every live object with buffered state, closed by the SIGTERM handler
+_closables: "weakref.WeakSet" = weakref.WeakSet()
+_previous_sigterm = None
+_sigterm_installed = False
+
+
+def _on_sigterm(signum, frame):
+    for obj in list(_closables):
+        try:
+            obj.close()
+        except Exception as e:
+            print(f"{type(obj).__name__} close on SIGTERM failed:", e)
+    if callable(_previous_sigterm):
+        _previous_sigterm(signum, frame)
+    elif _previous_sigterm != signal.SIG_IGN:
+        # default action: terminate as if the handler had never been installed
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def install_sigterm_handler() -> None:
+    """
+    Close every registered object when the process gets SIGTERM (how Cloud
+    Run and Cloud Functions stop instances; atexit does not run then).
+    Chains to the handler that was installed before. Only possible from
+    the main thread.
+    """
+    global _previous_sigterm, _sigterm_installed
+    if _sigterm_installed or threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        _previous_sigterm = signal.signal(signal.SIGTERM, _on_sigterm)
+    except ValueError:
+        return
+    _sigterm_installed = True
+
+
+def close_on_sigterm(obj) -> None:
+    """Call obj.close() on SIGTERM (obj is only weakly referenced)."""
+    _closables.add(obj)
+    install_sigterm_handler()
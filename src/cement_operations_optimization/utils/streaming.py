@@ -0,0 +1,154 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncIterator, Callable, List, Optional
+
+import pyarrow as pa
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+JSON = "json"
+NDJSON = "ndjson"
+ARROW = "arrow"
+
+MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+
+
+def negotiate_format(request: Request, requested: Optional[str] = None) -> str:
+    """?format= wins over the Accept header; anything else is plain JSON."""
+    if requested:
+        if requested not in (JSON, NDJSON, ARROW):
+            raise HTTPException(status_code=400, detail=f"Unsupported format: {requested}")
+        return requested
+    accept = request.headers.get("accept", "")
+    for fmt, media_type in MEDIA_TYPES.items():
+        if media_type in accept:
+            return fmt
+    return JSON
+
+
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, bytes):
+        return v.decode("utf-8", "replace")
+    return str(v)
+
+
+# Streamed pages end with their cursor, which is only known once the last
+# row has been sent: NDJSON as a final {"next_cursor": ...} line, Arrow as a
+# final empty record batch whose custom metadata holds next_cursor ("" when
+# there is no next page).
+# next_cursor(last_row, row_count) computes it (last_row is None if empty).
+NextCursor = Callable[[Optional[dict], int], Optional[str]]
+
+
+class _LastRow:
+    __slots__ = ("row", "count")
+
+    def __init__(self):
+        self.row = None
+        self.count = 0
+
+    def see(self, batch: pa.RecordBatch):
+        if batch.num_rows:
+            self.row = batch.slice(batch.num_rows - 1).to_pylist()[0]
+            self.count += batch.num_rows
+
+
+class _Chunks:
+    """File-like sink handing the Arrow IPC writer's output back chunk by chunk."""
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+async def ndjson_body(batches: AsyncIterator[pa.RecordBatch], next_cursor: Optional[NextCursor] = None) -> AsyncIterator[bytes]:
+    """One JSON object per line; one chunk per record batch."""
+    last = _LastRow()
+    async for batch in batches:
+        last.see(batch)
+        lines = [json.dumps(row, default=_json_default) for row in batch.to_pylist()]
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+    if next_cursor is not None:
+        yield (json.dumps({"next_cursor": next_cursor(last.row, last.count)}) + "\n").encode("utf-8")
+
+
+async def arrow_body(batches: AsyncIterator[pa.RecordBatch], next_cursor: Optional[NextCursor] = None) -> AsyncIterator[bytes]:
+    """
+    Arrow IPC stream: the schema message, then each batch as it arrives,
+    then the cursor batch (if any) and end-of-stream. An empty result is
+    sent with an empty schema.
+    """
+    sink, writer, schema, last = _Chunks(), None, None, _LastRow()
+    async for batch in batches:
+        if writer is None:
+            schema = batch.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        last.see(batch)
+        writer.write_batch(batch)
+        yield sink.take()
+    if writer is None:
+        schema = pa.schema([])
+        writer = pa.ipc.new_stream(sink, schema)
+    if next_cursor is not None:
+        cursor = next_cursor(last.row, last.count)
+        writer.write_batch(
+            pa.RecordBatch.from_pylist([], schema=schema),
+            custom_metadata={"next_cursor": cursor or ""},
+        )
+    writer.close()
+    yield sink.take()
+
+
+async def batches_from_rows(rows: List[dict]) -> AsyncIterator[pa.RecordBatch]:
+    """Already-materialised rows (e.g. downsampled) as a single record batch."""
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows)
+
+
+async def prefetch(batches: AsyncIterator[pa.RecordBatch]) -> AsyncIterator[pa.RecordBatch]:
+    """
+    Wait for the first batch before the response starts, so query errors
+    and timeouts still become proper HTTP errors instead of a cut-off 200.
+    """
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def chained():
+        if first is not None:
+            yield first
+        async for batch in batches:
+            yield batch
+
+    return chained()
+
+
+def streaming_response(
+    fmt: str,
+    batches: AsyncIterator[pa.RecordBatch],
+    headers: Optional[dict] = None,
+    next_cursor: Optional[NextCursor] = None,
+) -> StreamingResponse:
+    body = arrow_body(batches, next_cursor) if fmt == ARROW else ndjson_body(batches, next_cursor)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers=headers)
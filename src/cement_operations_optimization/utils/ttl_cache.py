@@ -0,0 +1,86 @@
+import time
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+HIT = "HIT"
+MISS = "MISS"
+STALE = "STALE"
+
+Loader = Callable[[], Union[Any, Awaitable[Any]]]
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class AsyncTTLCache:
+    """
+    Per-process result cache for expensive, shared query results.
+
+    - Fresh for ttl_seconds: served from memory (HIT).
+    - Up to stale_seconds after that: served as-is (STALE) while one
+      background refresh runs.
+    - Otherwise the caller waits for a load (MISS). Concurrent callers for
+      the same key share a single in-flight load (single-flight).
+
+    Sync loaders run in a worker thread so the event loop is never blocked.
+    """
+
+    def __init__(self, ttl_seconds: float, stale_seconds: float = 0.0):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: Dict[str, _Entry] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, key: str, loader: Loader) -> Tuple[Any, str, float]:
+        """Returns (value, cache status, age in seconds)."""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry.stored_at
+            if age < self.ttl_seconds:
+                return entry.value, HIT, age
+            if age < self.ttl_seconds + self.stale_seconds:
+                self._refresh(key, loader, background=True)
+                return entry.value, STALE, age
+
+        try:
+            value = await asyncio.shield(self._refresh(key, loader))
+        except Exception:
+            if entry is None:
+                raise
+            # serve the last good value rather than failing the request
+            return entry.value, STALE, now - entry.stored_at
+        return value, MISS, 0.0
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _refresh(self, key: str, loader: Loader, background: bool = False) -> asyncio.Future:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._done(key, f, background))
+        return fut
+
+    def _done(self, key: str, fut: asyncio.Future, background: bool):
+        self._inflight.pop(key, None)
+        if not fut.cancelled() and fut.exception() is not None and background:
+            print(f"Background refresh of {key} failed: {fut.exception()}")
+
+    async def _load(self, key: str, loader: Loader):
+        if inspect.iscoroutinefunction(loader):
+            value = await loader()
+        else:
+            value = await asyncio.to_thread(loader)
+        self._entries[key] = _Entry(value, time.monotonic())
+        return value
@@ -0,0 +1,173 @@
+import os
+import json
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+
+from cement_operations_optimization.utils import metrics
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "100"))
+# what to do when a client's queue is full: drop_oldest | disconnect
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+# a single send blocked longer than this marks the client as dead
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+QUEUE_DEPTH = metrics.Gauge(
+    "ws_queue_depth", "Messages waiting in a websocket client's outbound queue", ["broadcaster", "connection"]
+)
+CONNECTION_DROPS = metrics.Gauge(
+    "ws_connection_dropped_messages", "Messages dropped for a connected websocket client", ["broadcaster", "connection"]
+)
+DROPPED = metrics.Counter("ws_messages_dropped_total", "Messages dropped because a client queue was full", ["broadcaster"])
+SENT = metrics.Counter("ws_messages_sent_total", "Messages written to websocket clients", ["broadcaster"])
+DISCONNECTS = metrics.Counter("ws_disconnects_total", "Websocket clients removed by a broadcaster", ["broadcaster", "reason"])
+
+_ids = itertools.count(1)
+
+
+class _Client:
+    def __init__(self, ws: WebSocket, queue_size: int):
+        self.ws = ws
+        self.id = str(next(_ids))
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.writer: Optional[asyncio.Task] = None
+
+
+class Broadcaster:
+    """
+    Websocket fan-out that never waits on a client. Each connection gets a
+    bounded outbound queue drained by its own writer task; broadcast()
+    serialises the message once and only enqueues it. When a queue is full
+    the oldest message is dropped, or the client is disconnected, depending
+    on overflow_policy. Must be used from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        queue_size: int = WS_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT_SECONDS,
+    ):
+        if overflow_policy not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Unknown websocket overflow policy: {overflow_policy}")
+        self.name = name
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self._clients: Dict[WebSocket, _Client] = {}
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def register(self, ws: WebSocket) -> _Client:
+        """Start fanning out to an accepted websocket."""
+        client = self._clients.get(ws)
+        if client is None:
+            client = _Client(ws, self.queue_size)
+            client.writer = asyncio.create_task(self._write(client))
+            self._clients[ws] = client
+            QUEUE_DEPTH.set(0, broadcaster=self.name, connection=client.id)
+            CONNECTION_DROPS.set(0, broadcaster=self.name, connection=client.id)
+        return client
+
+    def unregister(self, ws: WebSocket, reason: str = "closed"):
+        client = self._clients.pop(ws, None)
+        if client is None:
+            return
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        QUEUE_DEPTH.remove(broadcaster=self.name, connection=client.id)
+        CONNECTION_DROPS.remove(broadcaster=self.name, connection=client.id)
+        DISCONNECTS.inc(broadcaster=self.name, reason=reason)
+
+    def broadcast(self, message: Any):
+        """Queue a message (dict or pre-serialised text) for every client."""
+        text = message if isinstance(message, str) else json.dumps(message)
+        for client in list(self._clients.values()):
+            self._offer(client, text)
+
+    def send(self, ws: WebSocket, message: Any):
+        """Queue a message for one registered client."""
+        client = self._clients.get(ws)
+        if client is not None:
+            self._offer(client, message if isinstance(message, str) else json.dumps(message))
+
+    async def serve(self, ws: WebSocket, producer: Optional[Callable[[WebSocket], Awaitable[None]]] = None):
+        """
+        Register an accepted websocket and hold the handler until the client
+        leaves or is dropped. An optional producer coroutine runs alongside
+        for per-connection messages (it should queue them with send()).
+        """
+        client = self.register(ws)
+        tasks = [asyncio.create_task(self._read_until_closed(ws)), client.writer]
+        if producer is not None:
+            tasks.append(asyncio.create_task(producer(ws)))
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.unregister(ws)
+
+    def stats(self) -> List[dict]:
+        return [
+            {"connection": c.id, "queue_depth": c.queue.qsize(), "dropped": c.dropped}
+            for c in self._clients.values()
+        ]
+
+    async def close(self):
+        for ws in list(self._clients):
+            self.unregister(ws, reason="shutdown")
+            await self._close_quietly(ws, status.WS_1001_GOING_AWAY)
+
+    def _offer(self, client: _Client, text: str):
+        if client.queue.full():
+            if self.overflow_policy == "disconnect":
+                print(f"Websocket client {client.id} on {self.name} is too slow, disconnecting")
+                self.unregister(client.ws, reason="slow_consumer")
+                asyncio.create_task(self._close_quietly(client.ws, status.WS_1013_TRY_AGAIN_LATER))
+                return
+            client.queue.get_nowait()
+            client.dropped += 1
+            DROPPED.inc(broadcaster=self.name)
+            CONNECTION_DROPS.set(client.dropped, broadcaster=self.name, connection=client.id)
+        client.queue.put_nowait(text)
+        QUEUE_DEPTH.set(client.queue.qsize(), broadcaster=self.name, connection=client.id)
+
+    async def _write(self, client: _Client):
+        while True:
+            text = await client.queue.get()
+            QUEUE_DEPTH.set(client.queue.qsize(), broadcaster=self.name, connection=client.id)
+            try:
+                await asyncio.wait_for(client.ws.send_text(text), self.send_timeout)
+            except asyncio.TimeoutError:
+                self.unregister(client.ws, reason="send_timeout")
+                await self._close_quietly(client.ws, status.WS_1013_TRY_AGAIN_LATER)
+                return
+            except Exception:
+                self.unregister(client.ws, reason="send_error")
+                return
+            SENT.inc(broadcaster=self.name)
+
+    @staticmethod
+    async def _read_until_closed(ws: WebSocket):
+        # incoming messages are ignored; this only notices the client going away
+        try:
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    @staticmethod
+    async def _close_quietly(ws: WebSocket, code: int):
+        try:
+            await ws.close(code=code)
+        except Exception:
+            pass